@@ -0,0 +1,102 @@
+"""On-disk cache of the per-window level envelope computed by find_speaking.
+
+Detection parameters like the threshold, silence_min_len or ease_in only
+post-process the envelope, so with a cached envelope they can be changed
+without decoding the file again. Entries are keyed by a fingerprint of the
+file and the analysis resolution, and the least recently used ones are
+evicted once the cache grows past CACHE_MAX_BYTES.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "audio_silence_splitter")
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Bytes hashed from each end of a file, hashing multi-GB recordings in full
+# would cost as much as decoding them
+FINGERPRINT_BYTES = 1024 * 1024
+
+
+def file_fingerprint(file_path):
+    """Hash of the file's size, mtime and first and last FINGERPRINT_BYTES."""
+    stat = os.stat(file_path)
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if stat.st_size > 2 * FINGERPRINT_BYTES:
+            f.seek(-FINGERPRINT_BYTES, os.SEEK_END)
+            digest.update(f.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def _entry_path(file_path, resolution, cache_dir):
+    cache_dir = cache_dir or CACHE_DIR
+    key = "-".join([file_fingerprint(file_path), *map(str, resolution)])
+    return os.path.join(cache_dir, key + ".npz")
+
+
+def load_levels(file_path, resolution, cache_dir=None):
+    """Cached (levels, duration) of file_path at resolution, or None.
+
+    resolution is any tuple identifying how the levels were computed.
+    """
+    entry = _entry_path(file_path, resolution, cache_dir)
+    try:
+        with np.load(entry) as data:
+            levels, duration = data["levels"], float(data["duration"])
+    except (OSError, KeyError, ValueError):
+        return None
+    # Touch the entry so eviction sees it as recently used
+    os.utime(entry)
+    return levels, duration
+
+
+def store_levels(
+    file_path,
+    resolution,
+    levels,
+    duration,
+    cache_dir=None,
+    max_bytes=None,
+):
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = _entry_path(file_path, resolution, cache_dir)
+    # Write next to the entry and rename, several workers may share the cache
+    fd, temp_path = tempfile.mkstemp(suffix=".npz", dir=cache_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, levels=levels, duration=duration)
+        os.replace(temp_path, entry)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _evict(cache_dir, max_bytes or CACHE_MAX_BYTES)
+
+
+def _evict(cache_dir, max_bytes):
+    # Only cache entries, the folder also holds the job ledger and the
+    # benchmark fixtures
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".npz"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
@@ -4,77 +4,1244 @@
 # https://gitlab.com/dak425/scripts/-/blob/master/trim_silenceV2
 # https://youtu.be/ak52RXKfDw8
 
-import math
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import glob
+import json
+import multiprocessing
+import multiprocessing.connection
 import os
-from moviepy import AudioFileClip, VideoFileClip
 from proglog.proglog import default_bar_logger
 import subprocess
 import re
+import signal
 import tempfile
 import os
+import sys
+import threading
+import time
 import imageio_ffmpeg
+import numpy as np
+
+import analysis_cache
+import instrumentation
 
 ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
 
+# Analysis decodes to the same format moviepy's audio reader uses (44.1 kHz,
+# stereo, 16 bit), so peak levels match what max_volume() reported.
+ANALYSIS_RATE = 44100
+ANALYSIS_CHANNELS = 2
+# Seconds of audio decoded per chunk by the streaming analysis
+STREAM_CHUNK_SECONDS = 2
+# Seconds without new data after which following a growing file stops
+FOLLOW_TIMEOUT_SECONDS = 60
+# Shortest time range a sharded analysis gives each decoder, shorter shards
+# spend more time starting ffmpeg than decoding
+MIN_SHARD_SECONDS = 60
+# Seconds every shard but the first decodes before its range and discards,
+# Opus needs 80 ms to converge after a seek and Vorbis the previous packet
+SHARD_PREROLL_SECONDS = 0.1
+# How much of the file's end get_audio_duration scans for packet timestamps
+DURATION_TAIL_SECONDS = 30
+# Container (extension) each audio codec can be stream copied into. FLAC is
+# left out, its frames carry absolute sample numbers that a copy can't reset.
+STREAM_COPY_CONTAINERS = {
+    "aac": ".m4a",
+    "alac": ".m4a",
+    "mp3": ".mp3",
+    "opus": ".opus",
+    "vorbis": ".ogg",
+    "pcm_s16le": ".wav",
+    "pcm_s24le": ".wav",
+    "pcm_f32le": ".wav",
+}
+# Files picked up from folders by the command line and the folder watcher
+MEDIA_EXTENSIONS = (".mp4", ".webm", ".mov", ".avi", ".mp3", ".wav", ".ogg", ".flac")
+# Level each detector thresholds, see detect_silence
+DETECTOR_MEASURES = {
+    "peak": "peak",
+    "rms": "rms",
+    "adaptive": "rms",
+    "hysteresis": "rms",
+}
+# Samples squared at a time by window_levels, bounds its float64 scratch memory
+MEAN_SQUARE_BATCH = 1 << 20
+# Takes export_intervals writes per ffmpeg process. Every take is an input
+# with its own demuxer and decoder, this bounds the open files and threads.
+EXPORT_TAKES_PER_RUN = 16
+# Normalization brings every take to this integrated loudness (in LUFS) with
+# a static gain, but never raises a take by more than the maximum gain or
+# its analysed peak above the ceiling (in dBFS). A limiter holds the exported
+# clips to the ceiling.
+NORMALIZATION_TARGET_LUFS = -16
+NORMALIZATION_MAX_GAIN_DB = 20
+NORMALIZATION_PEAK_DBFS = -1
+# ITU-R BS.1770 gating: 400 ms blocks every 100 ms step, blocks below the
+# absolute gate (in LUFS) or the relative gate (in LU below the ungated
+# loudness) are ignored
+LOUDNESS_STEP_SECONDS = 0.1
+LOUDNESS_BLOCK_STEPS = 4
+LOUDNESS_ABSOLUTE_GATE = -70
+LOUDNESS_RELATIVE_GATE = -10
+
 
 def get_audio_duration(filename):
-    cmd = [ffmpeg_path, "-i", filename, "-f", "null", "-"]
+    """Duration of filename in seconds, or None if it can't be determined.
+
+    Tries the container metadata first, then a packet scan of the last
+    DURATION_TAIL_SECONDS, and only decodes the whole file when both fail.
+    Results are cached per file path, size and modification time.
+    """
+    stat = os.stat(filename)
+    return _probe_duration(os.path.abspath(filename), stat.st_size, stat.st_mtime)
+
+
+@functools.lru_cache(maxsize=256)
+def _probe_duration(filename, size, mtime):
+    header = _probe_header(filename, size, mtime)
+    if header["duration"] is not None:
+        return header["duration"]
+
+    # No duration in the metadata (e.g. browser recorded webm). Read packet
+    # timestamps at the end of the file, ffmpeg can't seek to the tail without
+    # a duration and then scans all packets from the start, still no decoding.
+    start = header["start"]
+    try:
+        starts, ends = _read_packet_times(
+            filename, ["-sseof", f"-{DURATION_TAIL_SECONDS}", "-copyts"]
+        )
+    except OSError:
+        ends = []
+    if len(ends):
+        return max(ends) - start
+
+    # Last resort, decode all of the audio
+    cmd = [ffmpeg_path, *_audio_input(filename), "-map", "0:a:0", "-f", "null", "-"]
+    instrumentation.count("ffmpeg_processes")
     process = subprocess.run(
         cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True
     )
     output = process.stderr
     match = re.search(r"time=(\d+:\d+:\d+\.\d+)", output)
     if match:
-        time_str = match.group(1)
-        h, m, s = map(float, time_str.split(":"))
-        return h * 3600 + m * 60 + s
+        return _parse_time(match.group(1))
     return None
 
 
-def fix_audio_metadata(input_file):
-    if not os.path.exists(input_file):
-        raise FileNotFoundError(f"File not found: {input_file}")
+def _parse_time(time_str):
+    h, m, s = map(float, time_str.split(":"))
+    return h * 3600 + m * 60 + s
+
+
+def probe_header(filename):
+    """What ffmpeg reports when opening filename, without reading further.
+
+    A dict with the metadata "duration" (None if missing), the "start" time
+    and the "codec" of the first audio stream (None without audio). Cached
+    like get_audio_duration.
+    """
+    stat = os.stat(filename)
+    return _probe_header(os.path.abspath(filename), stat.st_size, stat.st_mtime)
+
+
+@functools.lru_cache(maxsize=256)
+def _probe_header(filename, size, mtime):
+    instrumentation.count("ffmpeg_processes")
+    process = subprocess.run(
+        _header_cmd(filename), stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    return _parse_header(process.stderr)
+
+
+def _header_cmd(filename):
+    # Without an output ffmpeg only prints the header and exits with an error
+    return [ffmpeg_path, "-i", os.fspath(filename)]
+
+
+def _parse_header(output):
+    duration = re.search(r"Duration: (\d+:\d+:\d+\.\d+)", output)
+    start = re.search(r"start: (-?\d+\.\d+)", output)
+    codec = re.search(r"Stream #\d+:\d+.*?: Audio: (\w+)", output)
+    return {
+        "duration": _parse_time(duration.group(1)) if duration else None,
+        "start": float(start.group(1)) if start else 0,
+        "codec": codec.group(1) if codec else None,
+    }
+
+
+def get_audio_codec(filename):
+    return probe_header(filename)["codec"]
+
+
+def _audio_input(file_in, *options):
+    # Opens file_in for its audio only. Video, subtitle and data streams are
+    # discarded while demuxing, options (e.g. seeking) go before -i.
+    return [*options, "-vn", "-sn", "-dn", "-i", os.fspath(file_in)]
+
+
+class AudioSource:
+    """The audio track of a media file, shared by all stages of a job.
+
+    The header is probed once, on creation, unless it is passed in. Every
+    ffmpeg run opens the file for its audio only (see _audio_input) and
+    reads the first audio stream, so analysis and export use the same
+    stream and the video of a recording is never demuxed into a decoder. It
+    is path-like, every function taking a file name accepts it.
+    """
+
+    def __init__(self, path, header=None):
+        self.path = os.fspath(path)
+        self.codec = (header or probe_header(self.path))["codec"]
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path
+
+
+def _read_packet_times(filename, input_args=()):
+    """Start and end times (in seconds) of the audio packets of filename.
+
+    Packets are only read, not decoded. input_args go before -i, e.g. to
+    seek.
+    """
+    instrumentation.count("ffmpeg_processes")
+    process = subprocess.run(
+        _packet_times_cmd(filename, input_args),
+        stderr=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise OSError(f"Could not read packets of {filename}: {process.stderr}")
+    return _parse_packet_times(process.stdout)
+
+
+def _packet_times_cmd(filename, input_args=()):
+    return [
+        ffmpeg_path,
+        "-v",
+        "error",
+        *_audio_input(filename, *input_args),
+        "-map",
+        "0:a:0",
+        "-c",
+        "copy",
+        "-f",
+        "framemd5",
+        "-",
+    ]
+
+
+def _parse_packet_times(output):
+    time_base = 1
+    starts = []
+    ends = []
+    for line in output.splitlines():
+        if line.startswith("#tb"):
+            num, den = line.split(":")[1].split("/")
+            time_base = int(num) / int(den)
+        elif line and not line.startswith("#"):
+            # stream, dts, pts, duration, size, hash
+            pts, duration = line.split(",")[2:4]
+            starts.append(int(pts) * time_base)
+            ends.append((int(pts) + int(duration)) * time_base)
+    return starts, ends
+
+
+def get_packet_boundaries(filename):
+    """Times (in seconds) at which the audio packets of filename start, plus
+    the end of the last packet. Packets are only read, not decoded."""
+    return _packet_boundaries(*_read_packet_times(filename))
+
+
+def _packet_boundaries(starts, ends):
+    return np.unique(starts + ends[-1:])
+
+
+def snap_to_packets(intervals, boundaries):
+    """Move interval edges to the nearest packet boundary.
+
+    Returns the snapped intervals and the largest shift (in seconds).
+    """
+    snapped = []
+    snap_error = 0
+    for interval in intervals:
+        edges = []
+        for t in interval:
+            i = np.clip(np.searchsorted(boundaries, t), 1, len(boundaries) - 1)
+            nearest = min(boundaries[i - 1], boundaries[i], key=lambda b: abs(b - t))
+            snap_error = max(snap_error, abs(nearest - t))
+            edges.append(float(nearest))
+        snapped.append(edges)
+    return snapped, float(snap_error)
+
+
+def _decode_cmd(file_in, sample_rate, channels, start=None, length=None, input_args=()):
+    # Seeking on the input side jumps straight to start, ffmpeg still trims
+    # the decoded audio to the exact sample
+    seek = ["-ss", str(start)] if start else []
+    if length is not None:
+        seek += ["-t", str(length)]
+    return [
+        ffmpeg_path,
+        "-v",
+        "error",
+        *_audio_input(file_in, *seek, *input_args),
+        "-map",
+        "0:a:0",
+        "-f",
+        "s16le",
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        str(sample_rate),
+        "-ac",
+        str(channels),
+        "-",
+    ]
+
+
+def read_pcm(file_in, sample_rate=ANALYSIS_RATE, channels=ANALYSIS_CHANNELS):
+    """Decode the audio track of file_in to 16 bit PCM in a single ffmpeg pass.
+
+    Returns an int16 array of shape (num_samples, channels).
+    """
+    cmd = _decode_cmd(file_in, sample_rate, channels)
+    instrumentation.count("ffmpeg_processes")
+    process = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    if process.returncode != 0:
+        raise OSError(
+            f"Could not decode audio from {file_in}: "
+            + process.stderr.decode(errors="replace").strip()
+        )
+    instrumentation.count("decoded_bytes", len(process.stdout))
+    return np.frombuffer(process.stdout, dtype=np.int16).reshape(-1, channels)
+
+
+def iter_pcm(
+    file_in,
+    chunk_samples,
+    sample_rate=ANALYSIS_RATE,
+    channels=ANALYSIS_CHANNELS,
+    start=None,
+    length=None,
+    input_args=(),
+):
+    """Like read_pcm, but yield the audio in chunks of chunk_samples samples.
+
+    Only one chunk is held in memory at a time, the last one may be shorter.
+    start and length (in seconds) limit decoding to part of the file,
+    input_args are passed to ffmpeg before the input.
+    """
+    cmd = _decode_cmd(file_in, sample_rate, channels, start, length, input_args)
+    chunk_bytes = chunk_samples * channels * 2
+    # stderr goes to a file so a chatty ffmpeg can never block on a full pipe
+    with tempfile.TemporaryFile() as stderr:
+        instrumentation.count("ffmpeg_processes")
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            while True:
+                data = process.stdout.read(chunk_bytes)
+                if not data:
+                    break
+                instrumentation.count("decoded_bytes", len(data))
+                # Drop a trailing partial sample frame, it can't be reshaped
+                data = data[: len(data) - len(data) % (channels * 2)]
+                yield np.frombuffer(data, dtype=np.int16).reshape(-1, channels)
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            raise OSError(
+                f"Could not decode audio from {file_in}: "
+                + stderr.read().decode(errors="replace").strip()
+            )
+
+
+def _biquad_response(b, a, w):
+    # Frequency response of a biquad at w (radians per sample)
+    z = np.exp(-1j * w)
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+
+@functools.lru_cache(maxsize=8)
+def _k_weighting(window_samples, sample_rate):
+    # Power gain of the BS.1770 K-weighting filter (a +4 dB high shelf above
+    # 1.5 kHz and a 38 Hz high pass) at each rfft bin of a window, designed
+    # for sample_rate like pyloudnorm does. Doubled for the bins standing in
+    # for their negative frequency, so summing the weighted power spectrum
+    # gives the filtered window's energy (Parseval).
+    w = 2 * np.pi * np.fft.rfftfreq(window_samples)
+    gain = 10 ** (4 / 40)
+    w0 = 2 * np.pi * 1500 / sample_rate
+    alpha = np.sin(w0) / np.sqrt(2)
+    cos, root = np.cos(w0), 2 * np.sqrt(gain) * alpha
+    shelf = _biquad_response(
+        [
+            gain * ((gain + 1) + (gain - 1) * cos + root),
+            -2 * gain * ((gain - 1) + (gain + 1) * cos),
+            gain * ((gain + 1) + (gain - 1) * cos - root),
+        ],
+        [
+            (gain + 1) - (gain - 1) * cos + root,
+            2 * ((gain - 1) - (gain + 1) * cos),
+            (gain + 1) - (gain - 1) * cos - root,
+        ],
+        w,
+    )
+    w0 = 2 * np.pi * 38 / sample_rate
+    alpha, cos = np.sin(w0), np.cos(w0)
+    high_pass = _biquad_response(
+        [(1 + cos) / 2, -(1 + cos), (1 + cos) / 2], [1 + alpha, -2 * cos, 1 - alpha], w
+    )
+    power = np.abs(shelf * high_pass) ** 2
+    power[1 : (window_samples + 1) // 2] *= 2
+    return power
+
+
+def k_weighted_mean_square(blocks, window_samples, sample_rate):
+    """Mean square (0..1) of each window of window_samples samples after
+    K-weighting, for (n, window_samples * channels) rows of int16 samples.
+
+    Weights the power spectrum of each window instead of running the
+    filter, which needs no state across windows or chunks. Edge effects
+    make the result differ from a filtered stream by a fraction of a dB.
+    """
+    channels = blocks.shape[1] // max(window_samples, 1)
+    weights = _k_weighting(window_samples, sample_rate)
+    mean_square = np.empty(len(blocks))
+    rows_per_batch = max(MEAN_SQUARE_BATCH // max(blocks.shape[1], 1), 1)
+    for first in range(0, len(blocks), rows_per_batch):
+        batch = blocks[first : first + rows_per_batch].reshape(
+            -1, window_samples, channels
+        )
+        spectrum = np.fft.rfft(batch.astype(np.float64), axis=1)
+        mean_square[first : first + rows_per_batch] = np.einsum(
+            "ijk,j->i", spectrum.real**2 + spectrum.imag**2, weights
+        )
+    return mean_square / (window_samples**2 * channels * 32768.0**2)
+
 
-    duration = get_audio_duration(input_file)
-    if duration is None:
-        raise ValueError("Could not determine duration of the input file.")
+def window_levels(samples, window_samples):
+    """Peak level and mean square (both 0..1) of each complete window of
+    window_samples samples, as an (n, 2) array of [peak, mean_square] rows."""
+    num_windows = len(samples) // window_samples
+    row_width = window_samples * samples.shape[1]
+    blocks = samples[: num_windows * window_samples].reshape(num_windows, row_width)
+    # Widen before negating, -(-32768) does not fit in int16
+    peaks = np.maximum(
+        blocks.max(axis=1, initial=0).astype(np.int32),
+        -blocks.min(axis=1, initial=0).astype(np.int32),
+    )
+    mean_square = np.empty(num_windows)
+    rows_per_batch = max(MEAN_SQUARE_BATCH // max(row_width, 1), 1)
+    for first in range(0, num_windows, rows_per_batch):
+        batch = blocks[first : first + rows_per_batch].astype(np.float64)
+        mean_square[first : first + rows_per_batch] = np.einsum(
+            "ij,ij->i", batch, batch
+        )
+    mean_square /= row_width * 32768.0**2
+    return np.column_stack([peaks / 32768, mean_square])
+
+
+def iter_window_levels(chunks, window_samples):
+    """Streaming window_levels: yield the levels of the windows completed by
+    each chunk as it arrives, carrying partial windows over to the next."""
+    remainder = None
+    for chunk in chunks:
+        if remainder is not None and len(remainder):
+            chunk = np.concatenate([remainder, chunk])
+        complete = len(chunk) - len(chunk) % window_samples
+        remainder = chunk[complete:]
+        yield window_levels(chunk[:complete], window_samples)
+
+
+class LoudnessMeter:
+    """K-weighted mean squares (see k_weighted_mean_square) of every
+    LOUDNESS_STEP_SECONDS step of the samples fed to it, in chunks of any
+    size.
+
+    The steps are on a grid from the start of the file, independent of the
+    analysis hops. first_sample is where the first chunk fed starts in the
+    file (in samples), the samples before the next step boundary are skipped.
+    """
+
+    def __init__(self, sample_rate, first_sample=0):
+        self.sample_rate = sample_rate
+        self.step_samples = max(int(round(LOUDNESS_STEP_SECONDS * sample_rate)), 1)
+        self._skip = -first_sample % self.step_samples
+        # Index of the first step measured
+        self.first_step = (first_sample + self._skip) // self.step_samples
+        self._remainder = None
+        self._steps = []
 
-    print(f"Calculated duration: {duration:.2f} seconds")
+    def feed(self, chunk):
+        skipped = min(self._skip, len(chunk))
+        self._skip -= skipped
+        chunk = chunk[skipped:]
+        if self._remainder is not None and len(self._remainder):
+            chunk = np.concatenate([self._remainder, chunk])
+        complete = len(chunk) - len(chunk) % self.step_samples
+        self._remainder = chunk[complete:]
+        self._steps.append(
+            k_weighted_mean_square(
+                chunk[:complete].reshape(-1, self.step_samples * chunk.shape[1]),
+                self.step_samples,
+                self.sample_rate,
+            )
+        )
 
-    # Create temp folder and output path
-    temp_dir = tempfile.mkdtemp()
-    output_file = os.path.join(temp_dir, "output_fixed.webm")
+    @property
+    def steps(self):
+        return np.concatenate([np.empty(0), *self._steps])
 
-    # Re-mux using FFmpeg
-    cmd = [ffmpeg_path, "-i", input_file, "-c", "copy", output_file]
-    subprocess.run(cmd, check=True)
 
-    return output_file
+def _merge_runs(starts, ends, merge_with_previous):
+    """Collapse each interval flagged in merge_with_previous into the one
+    before it. Returns an (n, 2) array of [start, end] rows."""
+    first_of_group = np.concatenate([[True], ~merge_with_previous])
+    last_of_group = np.concatenate([first_of_group[1:], [True]])
+    return np.column_stack([starts[first_of_group], ends[last_of_group]])
 
 
 def clean_intervals(intervals_to_keep, silence_min_len=5):
-    clean_intervals = []
-    for x in range(len(intervals_to_keep)):
-        # interval example[[0, 13.0], [13.5, 17.5], [39.5, 40.5]]
-        timestamp = intervals_to_keep[x]
-        if x >= 1:
-            previoustimestamp = intervals_to_keep[x - 1]
-            silence_gap = timestamp[0] - previoustimestamp[1]
-            if silence_gap < silence_min_len:
-                timestamp[0] = previoustimestamp[0]
-                clean_intervals.remove(previoustimestamp)
-        clean_intervals.append(timestamp)
-    # trim_START_END = [clean_intervals[0][0], clean_intervals[-1][1]]
-
-    return clean_intervals
-
-
-# Iterate over audio to find the non-silent parts. Outputs a list of
-# (speaking_start, speaking_end) intervals.
+    """Merge intervals separated by less than silence_min_len.
+
+    interval example [[0, 13.0], [13.5, 17.5], [39.5, 40.5]]. Returns a new
+    (n, 2) array, the input is left untouched.
+    """
+    intervals = np.asarray(intervals_to_keep, dtype=float).reshape(-1, 2)
+    if len(intervals) == 0:
+        return intervals
+    silence_gap = intervals[1:, 0] - intervals[:-1, 1]
+    return _merge_runs(intervals[:, 0], intervals[:, 1], silence_gap < silence_min_len)
+
+
+class SpeakingIntervalTracker:
+    """Window state machine that turns silence flags into speaking intervals.
+
+    Windows can be fed in any number of pieces, so the flags may come from a
+    generator that never holds the whole file. Call close() with the total
+    duration once all windows are in.
+    """
+
+    def __init__(self, window_size, silence_min_len=5, ease_in=0.6):
+        self.window_size = window_size
+        self.silence_min_len = silence_min_len
+        self.ease_in = ease_in
+        self.speaking_intervals = []
+        self.num_windows = 0
+        self._previous_is_silent = None
+        self._speaking_start = 0
+        # (speaking_start, speaking_end) of finished speech, held until enough
+        # audio follows to know whether the ease-out runs into the end of file
+        self._pending = collections.deque()
+
+    def feed(self, window_is_silent):
+        for e2 in window_is_silent:
+            i = self.num_windows
+            self.num_windows += 1
+            e1 = self._previous_is_silent
+            self._previous_is_silent = bool(e2)
+            if e1 is None:
+                continue
+            # silence -> speaking
+            if e1 and not e2:
+                self._speaking_start = i * self.window_size
+            # speaking -> silence, now have a speaking interval
+            if not e1 and e2:
+                self._pending.append((self._speaking_start, i * self.window_size))
+            while (
+                self._pending
+                and self._pending[0][1] + self.ease_in
+                <= self.num_windows * self.window_size
+            ):
+                speaking_start, speaking_end = self._pending.popleft()
+                self._add_interval(speaking_start, speaking_end + self.ease_in)
+
+    def close(self, duration):
+        while self._pending:
+            speaking_start, speaking_end = self._pending.popleft()
+            self._add_interval(
+                speaking_start,
+                (
+                    speaking_end + self.ease_in
+                    if speaking_end <= duration - self.ease_in
+                    else duration
+                ),
+            )
+        return self.speaking_intervals
+
+    def pop_closed(self):
+        """Remove and return the intervals that later windows can no longer
+        extend, because the silence after them is already long enough."""
+        # Earliest start a future interval can have
+        if self._pending:
+            next_start = self._pending[0][0]
+        elif self._previous_is_silent is False:
+            next_start = self._speaking_start
+        else:
+            next_start = self.num_windows * self.window_size
+        closed = len(self.speaking_intervals)
+        if (
+            closed
+            and next_start - self.ease_in - self.speaking_intervals[-1][1]
+            < self.silence_min_len
+        ):
+            closed -= 1
+        popped = self.speaking_intervals[:closed]
+        del self.speaking_intervals[:closed]
+        return popped
+
+    def _add_interval(self, speaking_start, end):
+        new_speaking_interval = [
+            speaking_start - self.ease_in if speaking_start != 0 else 0,
+            end,
+        ]
+        # Filter Intervals <= 2sec (crossfade=0.5)
+        if new_speaking_interval[1] - new_speaking_interval[0] <= 2:
+            return
+        # With tiny windows, this can sometimes overlap the previous window, so merge.
+        speaking_intervals = self.speaking_intervals
+        if len(speaking_intervals) > 0:
+            need_to_merge = speaking_intervals[-1][1] > new_speaking_interval[0]
+            # or if silence is too short
+            need_to_merge = (
+                need_to_merge
+                or new_speaking_interval[0] - speaking_intervals[-1][1]
+                < self.silence_min_len
+            )
+        else:
+            need_to_merge = False
+        if need_to_merge:
+            merged_interval = [speaking_intervals[-1][0], new_speaking_interval[1]]
+            speaking_intervals[-1] = merged_interval
+        else:
+            speaking_intervals.append(new_speaking_interval)
+
+
+def speaking_intervals_from_windows(
+    window_is_silent,
+    window_size,
+    duration,
+    silence_min_len=5,
+    ease_in=0.6,
+    frame_length=1,
+):
+    """Turn per-window silence flags into merged [start, end] speaking intervals.
+
+    Vectorized equivalent of SpeakingIntervalTracker, returns an (n, 2) array.
+    Windows start every window_size seconds; with frame_length > 1 they
+    overlap, each spanning frame_length of those steps.
+    """
+    silent = np.asarray(window_is_silent, dtype=bool)
+    # Windows whose state differs from the window before
+    changes = np.flatnonzero(silent[1:] != silent[:-1]) + 1
+    # speaking -> silence ends a speaking interval, silence -> speaking starts one
+    speaking_ends = changes[silent[changes]]
+    speaking_starts = changes[~silent[changes]]
+    if len(silent) and not silent[0]:
+        # Speaking from the first window on
+        speaking_starts = np.concatenate([[0], speaking_starts])
+    # Speech still running at the end has no end transition and is dropped
+    speaking_starts = speaking_starts[: len(speaking_ends)]
+
+    speaking_start = speaking_starts * window_size
+    if frame_length > 1:
+        # An overlapping window turns loud when speech enters its last step
+        speaking_start = np.where(
+            speaking_starts != 0,
+            speaking_start + (frame_length - 1) * window_size,
+            0,
+        )
+    speaking_end = speaking_ends * window_size
+    starts = np.where(speaking_start != 0, speaking_start - ease_in, 0)
+    ends = np.where(
+        speaking_end <= duration - ease_in, speaking_end + ease_in, duration
+    )
+    # Filter Intervals <= 2sec (crossfade=0.5)
+    keep = ends - starts > 2
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return np.empty((0, 2))
+    # Merge intervals overlapping the previous one (tiny windows) or
+    # separated from it by too short a silence
+    silence_gap = starts[1:] - ends[:-1]
+    return _merge_runs(
+        starts, ends, (silence_gap < 0) | (silence_gap < silence_min_len)
+    )
+
+
+def sliding_max(values, frame_length):
+    """Max of every run of frame_length consecutive values.
+
+    Uses running (cumulative) maxima within blocks of frame_length, so the
+    cost does not depend on frame_length.
+    """
+    num_frames = len(values) - frame_length + 1
+    if frame_length <= 1 or num_frames <= 0:
+        return values[: max(num_frames, 0)]
+    pad = -len(values) % frame_length
+    blocks = np.concatenate([values, np.full(pad, -np.inf)]).reshape(-1, frame_length)
+    # Max from the start of each block up to a value, and from a value to the
+    # end of its block. Every frame spans one block boundary at most.
+    prefix = np.maximum.accumulate(blocks, axis=1).ravel()
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.maximum(suffix[:num_frames], prefix[frame_length - 1 : len(values)])
+
+
+class _LevelStream:
+    """window_levels per hop, the number of samples and, with loudness, a
+    LoudnessMeter (None without) of PCM chunks fed in order. The streaming
+    analysis of analyse_levels and pipeline.analyse_levels."""
+
+    def __init__(self, hop_samples, sample_rate, loudness=False, first_sample=0):
+        self.hop_samples = hop_samples
+        # Samples to decode at a time, whole hops
+        self.chunk_samples = hop_samples * max(
+            int(STREAM_CHUNK_SECONDS * sample_rate / hop_samples), 1
+        )
+        self.decoded_samples = 0
+        self.meter = LoudnessMeter(sample_rate, first_sample) if loudness else None
+        self._remainder = None
+        # One level per hop is tiny next to the samples, keep them all
+        self._hop_levels = [np.empty((0, 2))]
+
+    def feed(self, chunk):
+        self.decoded_samples += len(chunk)
+        if self.meter:
+            self.meter.feed(chunk)
+        # Carry partial hops over to the next chunk
+        if self._remainder is not None and len(self._remainder):
+            chunk = np.concatenate([self._remainder, chunk])
+        complete = len(chunk) - len(chunk) % self.hop_samples
+        self._remainder = chunk[complete:]
+        self._hop_levels.append(window_levels(chunk[:complete], self.hop_samples))
+
+    def result(self):
+        return np.concatenate(self._hop_levels), self.decoded_samples, self.meter
+
+
+def _stream_levels(
+    file_in,
+    hop_samples,
+    sample_rate,
+    channels,
+    start=None,
+    length=None,
+    loudness=False,
+):
+    """window_levels of file_in decoded in chunks, the number of samples
+    decoded, and with loudness a LoudnessMeter fed the same samples (None
+    without). start and length (in seconds) limit it to part of the file."""
+    stream = _LevelStream(
+        hop_samples, sample_rate, loudness, int(round((start or 0) * sample_rate))
+    )
+    for chunk in iter_pcm(
+        file_in, stream.chunk_samples, sample_rate, channels, start, length
+    ):
+        stream.feed(chunk)
+    return stream.result()
+
+
+def _run_shard(conn, kwargs):
+    # terminate() sends SIGTERM, exiting through the finally blocks kills the
+    # shard's ffmpeg instead of leaving it to a broken pipe
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(1))
+    try:
+        conn.send((True, _stream_levels(**kwargs)))
+    except Exception as e:
+        conn.send((False, e))
+    finally:
+        conn.close()
+
+
+def sharded_levels(file_in, hop_samples, sample_rate, channels, shards, loudness=False):
+    """window_levels of file_in computed by up to shards decoders in parallel,
+    and the file's duration. None if the duration is unknown.
+
+    Each process decodes its own time range, the ranges start on hop
+    boundaries so the per-hop levels can be concatenated as they are and
+    windows spanning two shards are built afterwards. Needs a seekable file
+    with accurate timestamps. Every shard but the first starts decoding
+    SHARD_PREROLL_SECONDS (rounded up to whole hops) early and drops those
+    hops, codecs like Opus and Vorbis only decode correctly after a pre-roll.
+    Opus seeks can still land a few milliseconds off (8 ms on the benchmark
+    fixture), which changes the levels of windows around a level change by
+    a few percent compared to a single decoder.
+
+    With loudness, also returns the LOUDNESS_STEP_SECONDS steps of a
+    LoudnessMeter as a third value. A shard measures the step straddling
+    its end, the next one skips it.
+    """
+    duration = get_audio_duration(file_in)
+    if not duration:
+        return None
+    shards = max(min(shards, int(duration // MIN_SHARD_SECONDS)), 1)
+    total_hops = int(duration * sample_rate) // hop_samples
+    hops_per_shard = max(-(-total_hops // shards), 1)
+    hop_seconds = hop_samples / sample_rate
+    preroll_hops = int(np.ceil(SHARD_PREROLL_SECONDS / hop_seconds))
+
+    # A process per shard rather than a pool, a shard that dies (e.g. killed
+    # for memory) closes its pipe and fails the analysis instead of leaving
+    # it waiting, and a cancelled job terminates the shards still decoding
+    context = multiprocessing.get_context("spawn")
+    processes, pending = [], {}
+    try:
+        for index in range(shards):
+            preroll = preroll_hops if index else 0
+            kwargs = {
+                "file_in": file_in,
+                "hop_samples": hop_samples,
+                "sample_rate": sample_rate,
+                "channels": channels,
+                "start": (index * hops_per_shard - preroll) * hop_seconds,
+                # One hop extra, so rounding of the seek can't cut off the
+                # shard's last hop, and a loudness step for the one straddling
+                # its end. The last shard runs to the end of file.
+                "length": (
+                    (preroll + hops_per_shard + 1) * hop_seconds + LOUDNESS_STEP_SECONDS
+                    if index < shards - 1
+                    else None
+                ),
+                "loudness": loudness,
+            }
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_run_shard, args=(sender, kwargs), daemon=True
+            )
+            process.start()
+            sender.close()
+            processes.append(process)
+            pending[receiver] = index
+        results = [None] * shards
+        while pending:
+            for receiver in multiprocessing.connection.wait(list(pending)):
+                index = pending.pop(receiver)
+                try:
+                    ok, value = receiver.recv()
+                except EOFError:
+                    processes[index].join()
+                    raise OSError(
+                        f"Analysis shard {index + 1} of {file_in} died "
+                        f"(exit code {processes[index].exitcode})"
+                    ) from None
+                finally:
+                    receiver.close()
+                if not ok:
+                    raise value
+                results[index] = value
+    finally:
+        for receiver in pending:
+            receiver.close()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+    # The shards counted in their own processes
+    instrumentation.count("ffmpeg_processes", shards)
+    instrumentation.count(
+        "decoded_bytes", sum(samples for _, samples, _ in results) * channels * 2
+    )
+
+    hop_levels, steps = [], [np.empty(0)]
+    for index, (levels, decoded_samples, meter) in enumerate(results):
+        if meter:
+            # The shard's steps from the first one starting in its range
+            step_samples = meter.step_samples
+            first_step = -(-index * hops_per_shard * hop_samples // step_samples)
+            next_step = -(-(index + 1) * hops_per_shard * hop_samples // step_samples)
+            shard_steps = meter.steps[first_step - meter.first_step :]
+        if index:
+            levels = levels[preroll_hops:]
+            decoded_samples -= preroll_hops * hop_samples
+        if index < shards - 1 and len(levels) >= hops_per_shard:
+            hop_levels.append(levels[:hops_per_shard])
+            if meter:
+                steps.append(shard_steps[: next_step - first_step])
+            continue
+        # Last shard, or the file ended earlier than its metadata claimed
+        hop_levels.append(levels)
+        if meter:
+            steps.append(shard_steps)
+        duration = (
+            index * hops_per_shard * hop_samples + max(decoded_samples, 0)
+        ) / sample_rate
+        break
+    if loudness:
+        return np.concatenate(hop_levels), duration, np.concatenate(steps)
+    return np.concatenate(hop_levels), duration
+
+
+def sliding_mean(values, frame_length):
+    """Mean of every run of frame_length consecutive values."""
+    if frame_length <= 1:
+        return values
+    sums = np.concatenate([[0], np.cumsum(values)])
+    return (sums[frame_length:] - sums[:-frame_length]) / frame_length
+
+
+def analyse_levels(
+    file_in,
+    window_size=1,
+    logger="bar",
+    streaming=False,
+    analysis_rate=None,
+    use_cache=False,
+    hop_size=None,
+    measure="peak",
+    shards=1,
+    loudness=False,
+):
+    """Level (0..1) of every window of file_in, and its duration.
+
+    measure is "peak" for the window's peak level or "rms" for its RMS
+    level. Windows start every hop_size seconds (defaults to window_size,
+    i.e. no overlap). This is the expensive part of find_speaking,
+    everything else only post-processes the levels (see
+    intervals_from_levels). Arguments are the same as for find_speaking.
+    With loudness, the same decode also measures the loudness, returned as
+    a third value (a Loudness). It is cached as its own entry.
+    """
+    if measure not in ("peak", "rms"):
+        raise ValueError(f"Unknown level measure {measure!r}")
+    logger = default_bar_logger(logger)  # shorthand to generate a bar logger
+    sample_rate, channels, hop_samples, frame_length = _analysis_format(
+        window_size, hop_size, analysis_rate
+    )
+
+    cached = None
+    if use_cache:
+        cached = _load_analysis(file_in, hop_samples, sample_rate, channels, loudness)
+    sharded = None
+    if cached is None and shards > 1:
+        logger(message=f"Analysing audio in up to {shards} shards")
+        sharded = sharded_levels(
+            file_in, hop_samples, sample_rate, channels, shards, loudness
+        )
+    if cached is not None:
+        logger(message="Using cached analysis")
+        hop_levels, duration, steps = cached
+    elif sharded is not None:
+        hop_levels, duration, *sharded_steps = sharded
+        steps = sharded_steps[0] if loudness else None
+    elif streaming:
+        logger(message="Analysing audio")
+        hop_levels, decoded_samples, meter = _stream_levels(
+            file_in, hop_samples, sample_rate, channels, loudness=loudness
+        )
+        duration = decoded_samples / sample_rate
+        steps = meter.steps if loudness else None
+    else:
+        logger(message="Analysing audio")
+        samples = read_pcm(file_in, sample_rate, channels)
+        stream = _LevelStream(hop_samples, sample_rate, loudness)
+        stream.feed(samples)
+        del samples
+        hop_levels, decoded_samples, meter = stream.result()
+        duration = decoded_samples / sample_rate
+        steps = meter.steps if loudness else None
+
+    if use_cache and cached is None:
+        _store_analysis(
+            file_in, hop_samples, sample_rate, channels, hop_levels, duration, steps
+        )
+    return _analysis_result(
+        hop_levels, duration, steps, measure, frame_length, hop_samples / sample_rate
+    )
+
+
+def _load_analysis(file_in, hop_samples, sample_rate, channels, loudness=False):
+    # Cached hop levels, duration and loudness steps (None without loudness)
+    # of analyse_levels, None unless all of them are cached. The per-hop
+    # peaks and mean squares give any window size and either measure.
+    cached = analysis_cache.load_levels(
+        file_in, _envelope_resolution(hop_samples, sample_rate, channels)
+    )
+    if cached is None or not loudness:
+        return cached and (*cached, None)
+    cached_steps = analysis_cache.load_levels(
+        file_in, _loudness_resolution(sample_rate, channels)
+    )
+    return cached_steps and (*cached, cached_steps[0])
+
+
+def _store_analysis(
+    file_in, hop_samples, sample_rate, channels, hop_levels, duration, steps=None
+):
+    try:
+        analysis_cache.store_levels(
+            file_in,
+            _envelope_resolution(hop_samples, sample_rate, channels),
+            hop_levels,
+            duration,
+        )
+        if steps is not None:
+            analysis_cache.store_levels(
+                file_in, _loudness_resolution(sample_rate, channels), steps, duration
+            )
+    except OSError as e:
+        print(f"Could not write analysis cache: {e}")
+
+
+def _analysis_result(hop_levels, duration, steps, measure, frame_length, hop_seconds):
+    # What analyse_levels returns, with a Loudness when steps were measured
+    levels = _levels_from_hops(hop_levels, measure, frame_length)
+    if steps is None:
+        return levels, duration
+    return levels, duration, Loudness(steps, hop_levels[:, 0], hop_seconds)
+
+
+def _envelope_resolution(hop_samples, sample_rate, channels):
+    # Cache key of analyse_levels' per-hop levels
+    return ("envelope", hop_samples, sample_rate, channels)
+
+
+def _loudness_resolution(sample_rate, channels):
+    # Cache key of the LoudnessMeter steps measured by analyse_levels
+    return ("loudness", LOUDNESS_STEP_SECONDS, sample_rate, channels)
+
+
+def _analysis_format(window_size, hop_size, analysis_rate):
+    # Sample rate and channels to decode at, samples per hop and hops per
+    # window of analyse_levels
+    if analysis_rate:
+        sample_rate, channels = int(analysis_rate), 1
+    else:
+        sample_rate, channels = ANALYSIS_RATE, ANALYSIS_CHANNELS
+    frame_length = hops_per_window(window_size, hop_size)
+    hop_samples = max(int(round((hop_size or window_size) * sample_rate)), 1)
+    return sample_rate, channels, hop_samples, frame_length
+
+
+def hops_per_window(window_size, hop_size=None):
+    """Number of hops of hop_size (None for window_size) in a window.
+
+    Raises ValueError unless the window is a whole number of hops, rather
+    than silently analysing with another window or hop size.
+    """
+    if not hop_size:
+        return 1
+    if hop_size <= 0 or hop_size > window_size:
+        raise ValueError(
+            f"Hop size {hop_size:g} s must be positive and no larger than the "
+            f"window size {window_size:g} s"
+        )
+    ratio = window_size / hop_size
+    if abs(ratio - round(ratio)) > 1e-6 * ratio:
+        raise ValueError(
+            f"Window size {window_size:g} s is not a whole number of hops of "
+            f"{hop_size:g} s"
+        )
+    return int(round(ratio))
+
+
+def _levels_from_hops(hop_levels, measure, frame_length):
+    # Window levels from the [peak, mean_square] rows of each hop
+    if measure == "rms":
+        return np.sqrt(sliding_mean(hop_levels[:, 1], frame_length))
+    return sliding_max(hop_levels[:, 0], frame_length)
+
+
+def _check_detector(detector):
+    if detector not in DETECTOR_MEASURES:
+        raise ValueError(
+            f"Unknown detector {detector!r}, expected one of "
+            + ", ".join(DETECTOR_MEASURES)
+        )
+
+
+def to_dbfs(levels):
+    """Levels (0..1) in dBFS, digital silence is clamped to -200 dB."""
+    return 20 * np.log10(np.maximum(levels, 1e-10))
+
+
+class Loudness:
+    """Loudness of a file, measured by analyse_levels, for any time range.
+
+    Follows ITU-R BS.1770 (K-weighting, gated 400 ms blocks with 75%
+    overlap) on the LOUDNESS_STEP_SECONDS steps of a LoudnessMeter, peaks
+    are the per-hop peaks of the analysis. The clips are stereo, so a mono
+    analysis counts for both channels. At a reduced analysis_rate the highs
+    above its Nyquist frequency are missing from both, material with loud
+    highs measures too quiet.
+    """
+
+    def __init__(self, steps, hop_peaks, hop_seconds):
+        self.mean_squares = steps
+        self.peaks = hop_peaks
+        self.hop_seconds = hop_seconds
+
+    @staticmethod
+    def _range(start, end, seconds, count):
+        first = int(max(start, 0) / seconds)
+        last = count if end is None else int(np.ceil(end / seconds))
+        return slice(first, max(last, first + 1))
+
+    def integrated(self, start=0, end=None):
+        """Gated loudness (in LUFS) from start to end (in seconds, None for
+        the end of file), None if it's all below the absolute gate."""
+        mean_squares = self.mean_squares[
+            self._range(start, end, LOUDNESS_STEP_SECONDS, len(self.mean_squares))
+        ]
+        blocks = sliding_mean(
+            mean_squares, max(min(LOUDNESS_BLOCK_STEPS, len(mean_squares)), 1)
+        )
+        # Both channels of the clips count
+        blocks = blocks * 2
+        blocks = blocks[_lufs(blocks) > LOUDNESS_ABSOLUTE_GATE]
+        if len(blocks) == 0:
+            return None
+        blocks = blocks[_lufs(blocks) > _lufs(blocks.mean()) + LOUDNESS_RELATIVE_GATE]
+        return float(_lufs(blocks.mean()))
+
+    def peak(self, start=0, end=None):
+        """Sample peak (0..1) from start to end, at the analysis rate."""
+        hops = self._range(start, end, self.hop_seconds, len(self.peaks))
+        return float(self.peaks[hops].max(initial=0))
+
+    def gain(self, start=0, end=None, target=NORMALIZATION_TARGET_LUFS):
+        """Static gain (in dB) that brings start to end to the target
+        loudness, limited by NORMALIZATION_MAX_GAIN_DB and the peak ceiling.
+        0 for silence."""
+        loudness = self.integrated(start, end)
+        if loudness is None:
+            return 0.0
+        headroom = NORMALIZATION_PEAK_DBFS - to_dbfs(self.peak(start, end))
+        return float(min(target - loudness, NORMALIZATION_MAX_GAIN_DB, headroom))
+
+
+def _lufs(mean_squares):
+    return -0.691 + 10 * np.log10(np.maximum(mean_squares, 1e-20))
+
+
+def detect_silence(
+    levels,
+    detector="peak",
+    volume_threshold=0.01,
+    noise_percentile=10,
+    noise_margin_db=10,
+    hysteresis_db=6,
+):
+    """Flag the silent windows among levels, analysed with the measure
+    DETECTOR_MEASURES[detector].
+
+    peak, rms: silent below volume_threshold.
+    adaptive: silent below the noise floor, the noise_percentile-th
+        percentile of the levels, plus noise_margin_db. volume_threshold
+        stays the lower limit, for recordings with digital silence.
+    hysteresis: speech starts at volume_threshold and only stops once the
+        level drops hysteresis_db below it, so it does not flicker on and
+        off around a single threshold.
+    """
+    _check_detector(detector)
+    if detector in ("peak", "rms"):
+        return levels < volume_threshold
+    levels_db = to_dbfs(levels)
+    threshold_db = to_dbfs(volume_threshold)
+    if detector == "adaptive":
+        if len(levels_db):
+            noise_floor_db = np.percentile(levels_db, noise_percentile)
+            threshold_db = max(threshold_db, noise_floor_db + noise_margin_db)
+        return levels_db < threshold_db
+    # Windows above the on threshold switch speech on, windows below the off
+    # threshold switch it off, the ones in between keep the state of the last
+    # window that switched. Silence until the first switch.
+    speech_on = levels_db >= threshold_db
+    switches = speech_on | (levels_db < threshold_db - hysteresis_db)
+    last_switch = np.maximum.accumulate(
+        np.where(switches, np.arange(len(levels_db)), -1)
+    )
+    return ~(speech_on[last_switch] & (last_switch >= 0))
+
+
+def intervals_from_levels(
+    levels,
+    duration,
+    BEG_END_only=False,
+    silence_min_len=5,
+    volume_threshold=0.01,
+    window_size=1,
+    ease_in=0.6,
+    hop_size=None,
+    detector="peak",
+    noise_percentile=10,
+    noise_margin_db=10,
+    hysteresis_db=6,
+):
+    """Speaking intervals for window levels from analyse_levels, as an (n, 2)
+    array of [start, end] rows. Cheap enough to rerun on every parameter
+    change."""
+    frame_length = hops_per_window(window_size, hop_size)
+    hop_size = hop_size or window_size
+    window_is_silent = detect_silence(
+        levels,
+        detector,
+        volume_threshold,
+        noise_percentile,
+        noise_margin_db,
+        hysteresis_db,
+    )
+    speaking_intervals = speaking_intervals_from_windows(
+        window_is_silent,
+        hop_size,
+        duration,
+        silence_min_len,
+        ease_in,
+        frame_length=frame_length,
+    )
+    clean_speaking_intervals = clean_intervals(speaking_intervals, silence_min_len)
+
+    # Handle the BEG_END_only case
+    if BEG_END_only and len(speaking_intervals):
+        return np.array([[speaking_intervals[0, 0], speaking_intervals[-1, 1]]])
+    return clean_speaking_intervals
+
+
+# Iterate over audio to find the non-silent parts. Outputs an (n, 2) array of
+# (speaking_start, speaking_end) intervals. The duration is taken from the
+# decoded samples, so files with broken metadata need no repair first.
 # Args:
 #  window_size: (in seconds) hunt for silence in windows of this size
 #  volume_threshold: volume below this threshold is considered to be silence
 #  ease_in: (in seconds) add this much silence around speaking intervals
+#  streaming: decode in chunks of about STREAM_CHUNK_SECONDS instead of
+#   loading the whole track, memory stays constant regardless of file length
+#  analysis_rate: (in Hz) let ffmpeg downmix to mono and resample to this
+#   rate before detection, None analyses at moviepy's 44.1 kHz stereo
+#  use_cache: keep the window levels in the analysis cache, so runs with other
+#   thresholds on the same file skip the decode
+#  hop_size: (in seconds) start a window this often, windows overlap when it
+#   is smaller than window_size and cut points get hop_size precision. The
+#   file is still decoded once, None means hop_size = window_size
+#  detector: how windows are classified as silent, see detect_silence.
+#   "peak" thresholds the peak level, "rms" the RMS level, "adaptive"
+#   derives the threshold from the file's noise floor and "hysteresis" uses
+#   separate on and off thresholds. All work from the same cached analysis
+#  noise_percentile, noise_margin_db: noise floor percentile and the margin
+#   above it (in dB) for the adaptive detector
+#  hysteresis_db: (in dB) gap between the on and off threshold of the
+#   hysteresis detector
+#  shards: split the file into this many time ranges analysed by parallel
+#   processes, each streaming its range. Falls back to a single decoder when
+#   the duration can't be probed
+#  metrics: an instrumentation.Instrumentation that gets the "analysis" and
+#   "intervals" stages
+#  loudness: measure the loudness in the same decode and return it (a
+#   Loudness) as a third value, for normalizing the takes
 def find_speaking(
     file_in,
     BEG_END_only=False,
@@ -83,140 +1250,426 @@ def find_speaking(
     window_size=1,
     ease_in=0.6,
     logger="bar",
+    streaming=False,
+    analysis_rate=None,
+    use_cache=False,
+    hop_size=None,
+    detector="peak",
+    noise_percentile=10,
+    noise_margin_db=10,
+    hysteresis_db=6,
+    shards=1,
+    metrics=None,
+    loudness=False,
 ):
-    logger = default_bar_logger(logger)  # shorthand to generate a bar logger
-    try:
-        video_clip = VideoFileClip(file_in)
-        audio_clip = video_clip.audio
-    except:
-        try:
-            audio_clip = AudioFileClip(
-                file_in,
-            )
-        except OSError:
-            print("Error: Duration not found. Calculating duration...")
-            file_in = fix_audio_metadata(file_in)
-            audio_clip = AudioFileClip(
-                file_in,
+    _check_detector(detector)
+    with _stage(metrics, "analysis") as stage:
+        levels, duration, *measured = analyse_levels(
+            file_in,
+            window_size=window_size,
+            logger=logger,
+            streaming=streaming,
+            analysis_rate=analysis_rate,
+            use_cache=use_cache,
+            hop_size=hop_size,
+            measure=DETECTOR_MEASURES[detector],
+            shards=shards,
+            loudness=loudness,
+        )
+        stage["audio_seconds"] = duration
+    speaking_intervals = _intervals_stage(
+        metrics,
+        levels,
+        duration,
+        BEG_END_only=BEG_END_only,
+        silence_min_len=silence_min_len,
+        volume_threshold=volume_threshold,
+        window_size=window_size,
+        ease_in=ease_in,
+        hop_size=hop_size,
+        detector=detector,
+        noise_percentile=noise_percentile,
+        noise_margin_db=noise_margin_db,
+        hysteresis_db=hysteresis_db,
+    )
+    return (file_in, speaking_intervals, *measured)
+
+
+def _intervals_stage(metrics, levels, duration, **options):
+    # intervals_from_levels as the "intervals" stage, of find_speaking and
+    # pipeline.process
+    with _stage(metrics, "intervals") as stage:
+        intervals = intervals_from_levels(levels, duration, **options)
+        stage["intervals"] = len(intervals)
+    return intervals
+
+
+def _stage(metrics, name):
+    # Stage of an optional Instrumentation, a plain dict sink without one
+    if metrics is None:
+        return contextlib.nullcontext({})
+    return metrics.stage(name)
+
+
+# Semaphore every export ffmpeg process holds while it runs, shared between
+# the processes of a batch or GUI session to cap the exports running at once.
+# None for no cap, see share_export_slots.
+_export_slots = None
+
+
+def share_export_slots(slots):
+    """Make the exports of this process take turns on slots, a semaphore
+    (e.g. multiprocessing's BoundedSemaphore) shared with other processes.
+    Meant as the initializer of worker processes."""
+    global _export_slots
+    _export_slots = slots
+
+
+def _export_slot():
+    return _export_slots or contextlib.nullcontext()
+
+
+def normalize_takes(loudness, intervals, target=NORMALIZATION_TARGET_LUFS):
+    """Loudness stats of the [start, end] intervals from the Loudness
+    measured during analysis: the "integrated" loudness of the file and of
+    each of the "takes" (in LUFS, None for silence), and the static "gains"
+    (in dB) that bring every take to the target loudness."""
+    return {
+        "integrated": loudness.integrated(),
+        "takes": [loudness.integrated(start, end) for start, end in intervals],
+        "gains": [loudness.gain(start, end, target) for start, end in intervals],
+    }
+
+
+def export_intervals(file_in, intervals, clip_paths, gains=None):
+    """Write each [start, end] interval of file_in to the matching clip path.
+
+    Takes are written EXPORT_TAKES_PER_RUN at a time by one ffmpeg process,
+    which opens the file once per take, seeked to its start, and encodes
+    each to its own MP3. Nothing is buffered for takes further on, so memory
+    doesn't grow with the length of the file, and the silence between takes
+    is never decoded. gains are the normalization gains (in dB) of the
+    intervals, see normalize_takes, None to leave the levels alone.
+    """
+    if len(intervals) == 0:
+        return
+    print(f"Writing {len(clip_paths)} clip(s) from {file_in}")
+    for cmd in _export_intervals_cmds(file_in, intervals, clip_paths, gains):
+        instrumentation.count("ffmpeg_processes")
+        with _export_slot():
+            process = subprocess.run(cmd, stderr=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            raise OSError(f"Could not export clips: {process.stderr.strip()}")
+
+
+def _normalization_filter(gain):
+    # Rumble filter, the static gain (in dB) measured for the take, and a
+    # limiter holding the peaks at the ceiling. The analysis can miss peaks,
+    # at a reduced analysis_rate or between its samples. Resampled to the
+    # clips' rate first so the limiter sees the samples that get encoded.
+    return (
+        f"highpass=f=60,volume={gain:.2f}dB,aresample=44100,"
+        f"alimiter=limit={NORMALIZATION_PEAK_DBFS}dB:level=disabled:latency=1"
+    )
+
+
+def _take_input(file_in, start, end):
+    # Seeking on the input side jumps straight to the take and stops reading
+    # at its end, ffmpeg trims the decoded audio to the exact sample
+    return _audio_input(file_in, "-ss", str(max(start, 0)), "-to", str(end))
+
+
+def _take_output(index, clip_path, gain=None):
+    cmd = ["-map", f"{index}:a:0"]
+    if gain is not None:
+        cmd += ["-af", _normalization_filter(gain)]
+    # Same output format moviepy's write_audiofile produced
+    return cmd + ["-c:a", "libmp3lame", "-ar", "44100", "-ac", "2", clip_path]
+
+
+def _export_intervals_cmds(file_in, intervals, clip_paths, gains=None):
+    # One ffmpeg command per EXPORT_TAKES_PER_RUN takes, each take is an
+    # input of its own
+    for first in range(0, len(intervals), EXPORT_TAKES_PER_RUN):
+        takes = range(first, min(first + EXPORT_TAKES_PER_RUN, len(intervals)))
+        cmd = [ffmpeg_path, "-v", "error", "-y"]
+        for index in takes:
+            cmd += _take_input(file_in, *intervals[index])
+        for input_index, index in enumerate(takes):
+            cmd += _take_output(
+                input_index, clip_paths[index], None if gains is None else gains[index]
             )
-    num_windows = math.floor(audio_clip.end / window_size)
-    window_is_silent = []
-    for i in logger.iter_bar(timestamps=range(num_windows)):
-        s = audio_clip.subclipped(i * window_size, (i + 1) * window_size)
-        v = s.max_volume()
-        window_is_silent.append(v < volume_threshold)
-    # Find speaking intervals.
-    speaking_start = 0
-    speaking_end = 0
-    speaking_intervals = []
-    for i in range(1, len(window_is_silent)):
-        e1 = window_is_silent[i - 1]
-        e2 = window_is_silent[i]
-        # silence -> speaking
-        if e1 and not e2:
-            speaking_start = i * window_size
-        # speaking -> silence, now have a speaking interval
-        if not e1 and e2:
-            speaking_end = i * window_size
-            new_speaking_interval = [
-                speaking_start - ease_in if speaking_start != 0 else 0,
-                (
-                    speaking_end + ease_in
-                    if speaking_end <= audio_clip.duration - ease_in
-                    else audio_clip.duration
-                ),
-            ]
-            # Filter Intervals <= 2sec (crossfade=0.5)
-            if new_speaking_interval[1] - new_speaking_interval[0] <= 2:
-                continue
-            # With tiny windows, this can sometimes overlap the previous window, so merge.
-
-            if len(speaking_intervals) > 0:
-                need_to_merge = speaking_intervals[-1][1] > new_speaking_interval[0]
-                # or if silence is too short
-                need_to_merge = (
-                    need_to_merge
-                    or new_speaking_interval[0] - speaking_intervals[-1][1]
-                    < silence_min_len
+        yield cmd
+
+
+def _export_take_cmd(file_in, start, end, clip_path, gain=None):
+    return [
+        ffmpeg_path,
+        "-v",
+        "error",
+        "-y",
+        *_take_input(file_in, start, end),
+        *_take_output(0, clip_path, gain),
+    ]
+
+
+def export_take(file_in, start, end, clip_path, gain=None):
+    """Write the [start, end] interval of file_in to clip_path as MP3.
+
+    Seeks to start instead of decoding the file from the beginning, so the
+    cost only depends on the length of the take. gain is its normalization
+    gain in dB, None to leave the level alone.
+    """
+    _TakeExports().export(file_in, start, end, clip_path, gain)
+
+
+class _TakeExports:
+    """Runs export_take's ffmpeg processes so that kill() can stop all of
+    them at once, from another thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = set()
+        self._killed = False
+
+    def export(self, file_in, start, end, clip_path, gain=None):
+        cmd = _export_take_cmd(file_in, start, end, clip_path, gain)
+        self._acquire_slot()
+        try:
+            with self._lock:
+                if self._killed:
+                    raise OSError(f"Export of {clip_path} was stopped")
+                instrumentation.count("ffmpeg_processes")
+                process = subprocess.Popen(
+                    cmd, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
                 )
-            else:
-                need_to_merge = False
-            if need_to_merge:
-                merged_interval = [speaking_intervals[-1][0], new_speaking_interval[1]]
-                speaking_intervals[-1] = merged_interval
-            else:
-                speaking_intervals.append(new_speaking_interval)
+                self._running.add(process)
+            try:
+                _, errors = process.communicate()
+            except BaseException:
+                process.kill()
+                process.wait()
+                raise
+            finally:
+                with self._lock:
+                    self._running.discard(process)
+        finally:
+            if _export_slots:
+                _export_slots.release()
+        if process.returncode != 0:
+            raise OSError(f"Could not export {clip_path}: {errors.strip()}")
 
-    clean_speaking_intervals = clean_intervals(speaking_intervals, silence_min_len)
+    def _acquire_slot(self):
+        # Polls, so a kill() also stops threads still waiting for a slot
+        while _export_slots and not _export_slots.acquire(timeout=0.1):
+            if self._killed:
+                raise OSError("Export was stopped")
 
-    # Handle the BEG_END_only case
-    if BEG_END_only and speaking_intervals:
-        speaking_intervals_final = [
-            [speaking_intervals[0][0], speaking_intervals[-1][1]]
-        ]
-    else:
-        speaking_intervals_final = clean_speaking_intervals
+    def kill(self):
+        with self._lock:
+            self._killed = True
+            for process in self._running:
+                process.kill()
 
-    # Clean up resources
-    try:
-        audio_clip.close()
-    except:
-        pass
 
-    return file_in, speaking_intervals_final
+def export_takes(file_in, intervals, clip_paths, gains=None, workers=2):
+    """Write each interval of file_in to its clip path like export_intervals,
+    but with one export_take per interval and up to workers of them at once.
+
+    Every take is decoded on its own from a seek to its start, so takes are
+    encoded in parallel and parts of the file between takes aren't decoded
+    at all.
+    """
+    if len(intervals) == 0:
+        return
+    print(
+        f"Writing {len(clip_paths)} clip(s) from {file_in}, "
+        f"up to {workers} at a time"
+    )
+    exports = _TakeExports()
+    # Threads are enough, they only wait for their ffmpeg process
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        # Each take in a copy of this context, its ffmpeg counts for the job
+        futures = [
+            pool.submit(
+                contextvars.copy_context().run,
+                exports.export,
+                file_in,
+                start,
+                end,
+                clip_path,
+                None if gains is None else gains[index],
+            )
+            for index, ((start, end), clip_path) in enumerate(
+                zip(intervals, clip_paths)
+            )
+        ]
+        for future in futures:
+            future.result()
+    except BaseException:
+        # After an error or a cancelled job (SystemExit) the takes still
+        # encoding are killed rather than waited for
+        exports.kill()
+        raise
+    finally:
+        pool.shutdown(cancel_futures=True)
 
 
-def main(
+def follow_file(
     file_in,
     output_path=None,
     NORMALIZATION=False,
-    BEG_END_only=False,
     silence_min_len=5,
     volume_threshold=0.01,
     window_size=1,
     ease_in=0.6,
     logger="bar",
+    analysis_rate=None,
+    detector="peak",
+    follow_timeout=FOLLOW_TIMEOUT_SECONDS,
+    on_take=None,
+    metrics=None,
 ):
+    """Split file_in while it is still being written.
+
+    Audio is analysed as it is appended and each take is exported as soon
+    as the silence after it reaches silence_min_len (in minutes, like
+    split_file). Stops once the file did not grow for follow_timeout
+    seconds. on_take(clip_path, [start, end]) is called for every take.
+    Only the "peak" and "rms" detectors work incrementally, takes are
+    always encoded to MP3. Clips are named from output_path like split_file
+    names the takes of a file with several. Every export is an "export"
+    stage of metrics. Returns the same dict as split_file.
     """
-    Process an audio/video file by removing silent parts.
+    if detector not in ("peak", "rms"):
+        raise ValueError(f"Detector {detector!r} can't follow a growing file")
+    logger = default_bar_logger(logger)  # shorthand to generate a bar logger
+    if analysis_rate:
+        sample_rate, channels = int(analysis_rate), 1
+    else:
+        sample_rate, channels = ANALYSIS_RATE, ANALYSIS_CHANNELS
+    window_samples = max(int(round(window_size * sample_rate)), 1)
+    processing_folder, _ = clip_paths_for(file_in, output_path, [])
+    tracker = SpeakingIntervalTracker(window_size, silence_min_len * 60, ease_in)
+    intervals, clip_paths = [], []
+    # Window peaks and loudness so far, when normalizing
+    peaks = []
+    meter = LoudnessMeter(sample_rate) if NORMALIZATION else None
 
-    Args:
-        file_in: Input file path
-        output_path: Output file path or template for multiple clips
-        NORMALIZATION: Whether to apply audio normalization
-        BEG_END_only: If True, only trim beginning and end silence
-        silence_min_len: Minimum length of silence to be considered a break
-        volume_threshold: Volume below this threshold is considered silence
-        window_size: Size of window for analyzing silence
-        ease_in: Buffer to add before and after speech
-        logger: Type of progress logger to use
+    def export(takes):
+        for start, end in takes:
+            # Named like split_file names the takes of a file with several,
+            # how many there will be isn't known yet
+            clip_path = clip_paths_for(
+                file_in, output_path, [*intervals, [start, end], [end, end]]
+            )[1][-2]
+            logger(message=f"Take {start:.1f}-{end:.1f} s closed, writing {clip_path}")
+            gain = None
+            if NORMALIZATION:
+                gain = Loudness(
+                    meter.steps,
+                    np.concatenate([np.empty(0), *peaks]),
+                    window_samples / sample_rate,
+                ).gain(start, end)
+            with _stage(metrics, "export") as stage:
+                export_take(file_in, start, end, clip_path, gain)
+                stage.update(clips=1, audio_seconds=end - start)
+            intervals.append([start, end])
+            clip_paths.append(clip_path)
+            if on_take:
+                on_take(clip_path, [start, end])
+
+    logger(message=f"Following {file_in}")
+    decoded_samples = 0
+
+    def chunks():
+        nonlocal decoded_samples
+        # The file protocol's follow option keeps reading at the end of the
+        # file, rw_timeout ends it once nothing was appended for a while
+        for chunk in iter_pcm(
+            file_in,
+            window_samples * max(int(STREAM_CHUNK_SECONDS / window_size), 1),
+            sample_rate,
+            channels,
+            input_args=(
+                "-follow",
+                "1",
+                "-rw_timeout",
+                str(int(follow_timeout * 1000000)),
+            ),
+        ):
+            decoded_samples += len(chunk)
+            if meter:
+                meter.feed(chunk)
+            yield chunk
+
+    for levels in iter_window_levels(chunks(), window_samples):
+        if NORMALIZATION:
+            peaks.append(levels[:, 0])
+        if detector == "rms":
+            levels = np.sqrt(levels[:, 1])
+        else:
+            levels = levels[:, 0]
+        tracker.feed(detect_silence(levels, detector, volume_threshold))
+        export(tracker.pop_closed())
+    export(tracker.close(decoded_samples / sample_rate))
+    return {
+        "intervals": intervals,
+        "clips": clip_paths,
+        "output_folder": processing_folder,
+    }
+
+
+def export_stream_copy(file_in, intervals, clip_paths):
+    """Cut each interval of file_in into its clip path without re-encoding.
+
+    Cut points are moved to the nearest packet boundary, the clip paths need
+    a container matching the source codec (see STREAM_COPY_CONTAINERS).
+    Returns the largest cut point shift in seconds.
     """
-    silence_min_len = silence_min_len * 60  # Convert to seconds
-    # Get intervals to keep (non-silent parts)
-    analysed_file, intervals_to_keep = find_speaking(
-        file_in,
-        BEG_END_only=BEG_END_only,
-        silence_min_len=silence_min_len,
-        volume_threshold=volume_threshold,
-        window_size=window_size,
-        ease_in=ease_in,
-        logger=logger,
+    if len(intervals) == 0:
+        return 0
+    boundaries = get_packet_boundaries(file_in)
+    snapped, snap_error = snap_to_packets(intervals, boundaries)
+    print(
+        f"Copying {len(clip_paths)} clip(s) from {file_in}, "
+        f"cut points moved by up to {snap_error * 1000:.0f} ms"
     )
+    instrumentation.count("ffmpeg_processes")
+    with _export_slot():
+        process = subprocess.run(
+            _stream_copy_cmd(file_in, snapped, clip_paths),
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    if process.returncode != 0:
+        raise OSError(f"Could not export clips: {process.stderr.strip()}")
+    return snap_error
 
-    print("Keeping intervals:", intervals_to_keep)
 
-    # Determine if it's a video or audio file
-    try:
-        video_clip = VideoFileClip(analysed_file)
-        clip = video_clip.audio
-    except:
-        clip = AudioFileClip(analysed_file)
-
-    # Create subclippeds for each interval
-    keep_clips = [
-        clip.subclipped(max(start, 0), end) for [start, end] in intervals_to_keep
-    ]
+def _stream_copy_cmd(file_in, snapped, clip_paths):
+    cmd = [ffmpeg_path, "-v", "error", "-y", *_audio_input(file_in)]
+    for (start, end), clip_path in zip(snapped, clip_paths):
+        # Half a millisecond of slack so float rounding can't drop or add a
+        # packet at the snapped edges
+        cmd += [
+            "-map",
+            "0:a:0",
+            "-c",
+            "copy",
+            "-ss",
+            f"{max(start - 0.0005, 0):.4f}",
+            "-to",
+            f"{end - 0.0005:.4f}",
+            clip_path,
+        ]
+    return cmd
+
 
+def clip_paths_for(file_in, output_path, intervals, BEG_END_only=False):
+    """Output folder and clip paths for the intervals split_file keeps of
+    file_in, see split_file for output_path."""
     # Determine output folder and filename
     if output_path:
         # If output_path is a directory, use it as processing_folder
@@ -260,7 +1713,7 @@ def main(
         # Default output location
         processing_folder = os.path.join(os.path.dirname(file_in), "processing")
         # use the input file name as the base if audio is only trimmed
-        if intervals_to_keep.__len__() == 1:
+        if len(intervals) == 1:
             filename_template = os.path.splitext(os.path.basename(file_in))[0] + ".mp3"
         else:
             filename_template = (
@@ -270,45 +1723,522 @@ def main(
     # Ensure the output directory exists
     os.makedirs(processing_folder, exist_ok=True)
 
-    # Process and save each clip
-    for index, audio_clip in enumerate(keep_clips):
+    # Name each clip
+    clip_paths = []
+    for index, (start, end) in enumerate(intervals):
         # Format the filename
         if "{" in filename_template and "}" in filename_template:
-            # Use advanced formatting with the template
-            original_name = os.path.splitext(os.path.basename(file_in))[0]
-            start, end = intervals_to_keep[index]
-
-            clip_filename = filename_template.format(index + 1)
+            # Use advanced formatting with the template, {0} and {index}
+            # are the take number, {start} and {end} its times in seconds
+            clip_filename = filename_template.format(
+                index + 1,
+                index=index + 1,
+                filename=os.path.splitext(os.path.basename(file_in))[0],
+                start=round(float(max(start, 0)), 1),
+                end=round(float(end), 1),
+            )
             # Ensure mp3 extension
             clip_filename = os.path.splitext(clip_filename)[0] + ".mp3"
         else:
             # Simple formatting
             clip_filename = filename_template
 
-        clip_path = os.path.join(processing_folder, clip_filename)
+        clip_paths.append(os.path.join(processing_folder, clip_filename))
+    return processing_folder, clip_paths
 
-        # Save the file (always as MP3)
-        audio_clip.write_audiofile(
-            clip_path,
-            ffmpeg_params=(
-                ["-af", "highpass=f=60,dynaudnorm=f=150:g=15:p=0.7:m=10:s=0"]
-                if NORMALIZATION
-                else []
-            ),
+
+def split_file(
+    file_in,
+    output_path=None,
+    NORMALIZATION=False,
+    BEG_END_only=False,
+    silence_min_len=5,
+    volume_threshold=0.01,
+    window_size=1,
+    ease_in=0.6,
+    logger="bar",
+    streaming=False,
+    analysis_rate=None,
+    stream_copy=False,
+    use_cache=False,
+    hop_size=None,
+    detector="peak",
+    noise_percentile=10,
+    noise_margin_db=10,
+    hysteresis_db=6,
+    shards=1,
+    export_workers=1,
+    follow=False,
+    follow_timeout=FOLLOW_TIMEOUT_SECONDS,
+    on_stage=None,
+    metrics_path=None,
+):
+    """
+    Process an audio/video file by removing silent parts.
+
+    Returns a dict with the kept "intervals", the written "clips", the
+    "output_folder" and the timing events of its "stages". With stream_copy,
+    "snap_error" is the largest cut point shift in seconds (see
+    export_stream_copy). When normalizing,
+    "loudness" has the stats and gains of normalize_takes.
+
+    Args:
+        file_in: Input file path
+        output_path: Output file path or template for multiple clips, with
+            the fields {filename}, {index} (or {0}), {start} and {end}
+        NORMALIZATION: Bring every take to NORMALIZATION_TARGET_LUFS with
+            a static gain, from the loudness measured during analysis, and
+            limit its peaks to NORMALIZATION_PEAK_DBFS. A reduced
+            analysis_rate measures speech a few LU too quiet.
+        BEG_END_only: If True, only trim beginning and end silence
+        silence_min_len: Minimum length of silence to be considered a break
+        volume_threshold: Volume below this threshold is considered silence
+        window_size: Size of window for analyzing silence
+        ease_in: Buffer to add before and after speech
+        logger: Type of progress logger to use
+        streaming: Analyse in constant memory instead of loading the whole track
+        analysis_rate: Mono sample rate to analyse at, None for 44.1 kHz stereo
+        stream_copy: Cut without re-encoding into a container matching the
+            source codec, falls back to MP3 when normalizing
+        use_cache: Reuse and store the analysis in the on-disk analysis cache
+        hop_size: Time between window starts (cut precision), None for
+            window_size
+        detector: Silence detector, "peak", "rms", "adaptive" or "hysteresis"
+        noise_percentile: Percentile of the levels taken as the noise floor
+            by the adaptive detector
+        noise_margin_db: Margin above the noise floor for the adaptive detector
+        hysteresis_db: Gap between the on and off threshold of the hysteresis
+            detector
+        shards: Number of processes analysing parts of the file in parallel
+        export_workers: Takes encoded at once, each by its own ffmpeg that
+            seeks to the take (see export_takes), 1 to encode them one
+            after the other in a few processes (see export_intervals)
+        follow: Split file_in while it is still being written, see
+            follow_file (ignores the options it does not support)
+        follow_timeout: Seconds without new data after which following stops
+        on_stage: Called with an event dict for every stage (probe,
+            analysis, intervals, export) and at the end of the run, see
+            instrumentation.Instrumentation
+        metrics_path: JSON lines file the same events are appended to
+    """
+    metrics = instrumentation.Instrumentation(file_in, on_stage, metrics_path)
+    with metrics.run() as totals:
+        if follow:
+            result = follow_file(
+                file_in,
+                output_path,
+                NORMALIZATION=NORMALIZATION,
+                silence_min_len=silence_min_len,
+                volume_threshold=volume_threshold,
+                window_size=window_size,
+                ease_in=ease_in,
+                logger=logger,
+                analysis_rate=analysis_rate,
+                detector=detector,
+                follow_timeout=follow_timeout,
+                metrics=metrics,
+            )
+            totals["clips"] = len(result["clips"])
+            return {**result, "stages": metrics.events}
+        silence_min_len = silence_min_len * 60  # Convert to seconds
+        # Open the source once, analysis and export share its header
+        with metrics.stage("probe"):
+            source = AudioSource(file_in)
+        if source.codec is None:
+            raise ValueError(f"{file_in} has no audio stream")
+        # Get intervals to keep (non-silent parts)
+        _, intervals_to_keep, *measured = find_speaking(
+            source,
+            BEG_END_only=BEG_END_only,
+            silence_min_len=silence_min_len,
+            volume_threshold=volume_threshold,
+            window_size=window_size,
+            ease_in=ease_in,
+            logger=logger,
+            streaming=streaming,
+            analysis_rate=analysis_rate,
+            use_cache=use_cache,
+            hop_size=hop_size,
+            detector=detector,
+            noise_percentile=noise_percentile,
+            noise_margin_db=noise_margin_db,
+            hysteresis_db=hysteresis_db,
+            shards=shards,
+            metrics=metrics,
+            loudness=NORMALIZATION,
         )
 
-    # Clean up resources
-    clip.close()
+        processing_folder, clip_paths, container, normalization = _plan_export(
+            source,
+            output_path,
+            intervals_to_keep,
+            BEG_END_only,
+            measured[0] if NORMALIZATION else None,
+            stream_copy,
+        )
+        gains = normalization["gains"] if normalization else None
 
-    if not intervals_to_keep:
-        processing_folder = "Audio was silent, no clips created."
+        # All clips are saved in one stage, by a few ffmpeg processes unless
+        # takes are encoded in parallel
+        snap_error = None
+        with metrics.stage("export") as stage:
+            if container:
+                snap_error = export_stream_copy(source, intervals_to_keep, clip_paths)
+                stage["snap_error"] = snap_error
+            elif export_workers > 1 and len(intervals_to_keep) > 1:
+                export_takes(
+                    source,
+                    intervals_to_keep,
+                    clip_paths,
+                    gains,
+                    workers=export_workers,
+                )
+            else:
+                export_intervals(source, intervals_to_keep, clip_paths, gains)
+            stage.update(_export_fields(intervals_to_keep, clip_paths))
+        return _split_result(
+            metrics,
+            totals,
+            intervals_to_keep,
+            processing_folder,
+            clip_paths,
+            snap_error,
+            normalization,
+        )
 
-    return processing_folder
 
+def _plan_export(
+    source, output_path, intervals, BEG_END_only=False, loudness=None, stream_copy=False
+):
+    # Output folder, clip paths, stream copy container (None to encode MP3)
+    # and normalize_takes stats (None without the Loudness) for the intervals
+    # of split_file and pipeline.process
+    print("Keeping intervals:", intervals.tolist())
+    normalization = None
+    if loudness is not None:
+        normalization = normalize_takes(loudness, intervals)
+        print(
+            "Normalization gains (dB):",
+            [round(gain, 1) for gain in normalization["gains"]],
+        )
+    processing_folder, clip_paths = clip_paths_for(
+        os.fspath(source), output_path, intervals, BEG_END_only
+    )
+    # Stream copy when asked for and possible, normalizing needs a re-encode
+    container = None
+    if stream_copy and loudness is None:
+        container = STREAM_COPY_CONTAINERS.get(source.codec)
+        if container:
+            clip_paths = [os.path.splitext(p)[0] + container for p in clip_paths]
+        else:
+            print("Source codec can't be stream copied, encoding MP3 instead")
+    return processing_folder, clip_paths, container, normalization
 
-if __name__ == "__main__":
-    main(
-        r"C:\Users\Max\Downloads\CTFT RAW\Deutsch_20250513_22_04.webm",
-        # NORMALIZATION=True,
-        BEG_END_only=True,
+
+def _export_fields(intervals, clip_paths):
+    # Fields of the "export" stage
+    return {
+        "clips": len(clip_paths),
+        "audio_seconds": float(sum(end - max(start, 0) for start, end in intervals)),
+    }
+
+
+def _split_result(
+    metrics,
+    totals,
+    intervals,
+    processing_folder,
+    clip_paths,
+    snap_error=None,
+    normalization=None,
+):
+    # What split_file and pipeline.process return
+    totals["clips"] = len(clip_paths)
+    result = {
+        "intervals": intervals.tolist(),
+        "clips": clip_paths,
+        "output_folder": processing_folder,
+        "stages": metrics.events,
+    }
+    if snap_error is not None:
+        result["snap_error"] = snap_error
+    if normalization:
+        result["loudness"] = normalization
+    return result
+
+
+def main(file_in, output_path=None, **kwargs):
+    """Process file_in like split_file (same arguments) and return the output
+    folder, or a message if the audio was silent."""
+    result = split_file(file_in, output_path, **kwargs)
+    if not result["clips"]:
+        return "Audio was silent, no clips created."
+    return result["output_folder"]
+
+
+def expand_inputs(inputs, recursive=False):
+    """Files named by inputs, which may be files, glob patterns or folders.
+
+    Folders contribute their files with a MEDIA_EXTENSIONS extension. Each
+    file is listed once, in the order it was first named.
+    """
+    files = []
+    for pattern in inputs:
+        matches = sorted(glob.glob(pattern, recursive=recursive)) or [pattern]
+        for path in matches:
+            if os.path.isdir(path):
+                walk = os.walk(path) if recursive else [next(os.walk(path))]
+                files.extend(
+                    os.path.join(folder, name)
+                    for folder, _, names in walk
+                    for name in sorted(names)
+                    if os.path.splitext(name)[1].lower() in MEDIA_EXTENSIONS
+                )
+            else:
+                files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def _batch_job(file_in, options):
+    # Log lines go to stderr, stdout is kept for the JSON summary
+    started = time.monotonic()
+
+    def log_stage(event):
+        print(f"{file_in}: {instrumentation.describe(event)}")
+
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            result = split_file(file_in, logger=None, on_stage=log_stage, **options)
+        except Exception as e:
+            result = {"status": "failed", "error": str(e)}
+        else:
+            result["status"] = "done"
+    return {
+        "file": file_in,
+        **result,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def _clip_collisions(files, output_path=None, BEG_END_only=False):
+    # Files whose clips would get the same paths as those of an earlier file
+    # (e.g. t.wav and t.webm, or a/talk.mp4 and b/talk.mp4 in one output
+    # folder), mapped to that file. Paths are compared without extension, a
+    # stream copy changes it.
+    owners, collisions = {}, {}
+    for file_in in files:
+        paths = {
+            os.path.normcase(os.path.abspath(os.path.splitext(path)[0]))
+            for intervals in ([[0, 1]], [[0, 1], [1, 2]])
+            for path in clip_paths_for(file_in, output_path, intervals, BEG_END_only)[1]
+        }
+        other = next((owners[path] for path in paths if path in owners), None)
+        if other:
+            collisions[file_in] = other
+        else:
+            owners.update(dict.fromkeys(paths, file_in))
+    return collisions
+
+
+def run_batch(files, workers=None, export_slots=None, **options):
+    """Run split_file on every file in a pool of worker processes.
+
+    At most export_slots (default: the number of CPUs) export ffmpeg
+    processes run at once across all workers, see share_export_slots.
+    Returns one summary dict per file, in the order of files. Failures are
+    reported with status "failed" and the error instead of raising. A file
+    whose clips would overwrite those of an earlier file fails without
+    being processed.
+    """
+    results = {}
+    collisions = _clip_collisions(
+        files, options.get("output_path"), options.get("BEG_END_only", False)
     )
+    for file_in, other in collisions.items():
+        results[file_in] = {
+            "file": file_in,
+            "status": "failed",
+            "error": f"its clips would overwrite those of {other}",
+        }
+        print(
+            f"[{len(results)}/{len(files)}] failed: {file_in} "
+            f"({results[file_in]['error']})",
+            file=sys.stderr,
+        )
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count() or 1,
+        mp_context=context,
+        initializer=share_export_slots,
+        initargs=(context.BoundedSemaphore(export_slots or os.cpu_count() or 1),),
+    ) as pool:
+        futures = {
+            pool.submit(_batch_job, file_in, options): file_in
+            for file_in in files
+            if file_in not in collisions
+        }
+        for future in concurrent.futures.as_completed(futures):
+            file_in = futures[future]
+            try:
+                results[file_in] = future.result()
+            except Exception as e:
+                # The worker process itself died
+                results[file_in] = {
+                    "file": file_in,
+                    "status": "failed",
+                    "error": str(e),
+                }
+            summary = results[file_in]
+            print(
+                f"[{len(results)}/{len(files)}] {summary['status']}: {file_in}"
+                + (f" ({summary['error']})" if summary["status"] == "failed" else ""),
+                file=sys.stderr,
+            )
+    return [results[file_in] for file_in in files]
+
+
+def run_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Split audio/video files into takes at long silences."
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="files, glob patterns or folders to process"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="folder for the clips, defaults to a processing folder next to each file",
+    )
+    parser.add_argument(
+        "-r", "--recursive", action="store_true", help="descend into subfolders"
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="files processed in parallel, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--summary",
+        default="-",
+        help="where to write the JSON summary, - (default) for stdout",
+    )
+    parser.add_argument(
+        "--beg-end-only",
+        action="store_true",
+        help="only trim silence at the beginning and end",
+    )
+    parser.add_argument(
+        "--silence-min-len",
+        type=float,
+        default=5,
+        help="minimum silence between takes in minutes (default 5)",
+    )
+    parser.add_argument("--volume-threshold", type=float, default=0.01)
+    parser.add_argument("--detector", choices=list(DETECTOR_MEASURES), default="peak")
+    parser.add_argument("--noise-margin-db", type=float, default=10)
+    parser.add_argument("--hysteresis-db", type=float, default=6)
+    parser.add_argument("--window-size", type=float, default=1)
+    parser.add_argument("--hop-size", type=float)
+    parser.add_argument("--ease-in", type=float, default=0.6)
+    parser.add_argument(
+        "--analysis-rate",
+        type=int,
+        default=8000,
+        help="mono sample rate for the analysis, 0 for 44.1 kHz stereo",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="processes analysing parts of each file in parallel",
+    )
+    parser.add_argument(
+        "--export-workers",
+        type=int,
+        default=1,
+        help="takes of each file encoded in parallel, each seeking to its take",
+    )
+    parser.add_argument(
+        "--export-slots",
+        type=int,
+        help="exports running at once across all files, defaults to the "
+        "number of CPUs",
+    )
+    parser.add_argument(
+        "--normalize",
+        action="store_true",
+        help=f"bring every take to {NORMALIZATION_TARGET_LUFS} LUFS with a static gain, "
+        f"peaks limited to {NORMALIZATION_PEAK_DBFS} dBFS. A reduced --analysis-rate "
+        "misses the highs, takes come out a little loud",
+    )
+    parser.add_argument("--stream-copy", action="store_true")
+    parser.add_argument(
+        "--cache", action="store_true", help="use the on-disk analysis cache"
+    )
+    parser.add_argument(
+        "--metrics",
+        help="append per-stage timings of every file to this JSON lines file",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="split files that are still being written, writing each take "
+        "as soon as it is complete",
+    )
+    parser.add_argument(
+        "--follow-timeout",
+        type=float,
+        default=FOLLOW_TIMEOUT_SECONDS,
+        help="stop following a file after this many seconds without new data",
+    )
+    args = parser.parse_args(argv)
+
+    files = expand_inputs(args.inputs, args.recursive)
+    missing = [path for path in files if not os.path.isfile(path)]
+    if missing:
+        parser.error("no such file: " + ", ".join(missing))
+    try:
+        hops_per_window(args.window_size, args.hop_size)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    summary = run_batch(
+        files,
+        workers=args.workers,
+        export_slots=args.export_slots,
+        output_path=args.output,
+        NORMALIZATION=args.normalize,
+        BEG_END_only=args.beg_end_only,
+        silence_min_len=args.silence_min_len,
+        volume_threshold=args.volume_threshold,
+        window_size=args.window_size,
+        hop_size=args.hop_size,
+        ease_in=args.ease_in,
+        streaming=True,
+        analysis_rate=args.analysis_rate or None,
+        stream_copy=args.stream_copy,
+        use_cache=args.cache,
+        detector=args.detector,
+        noise_margin_db=args.noise_margin_db,
+        hysteresis_db=args.hysteresis_db,
+        shards=args.shards,
+        export_workers=args.export_workers,
+        follow=args.follow,
+        follow_timeout=args.follow_timeout,
+        metrics_path=args.metrics,
+    )
+    failed = sum(result["status"] == "failed" for result in summary)
+    text = json.dumps({"files": summary, "failed": failed}, indent=2)
+    if args.summary == "-":
+        print(text)
+    else:
+        with open(args.summary, "w") as f:
+            f.write(text + "\n")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_cli())
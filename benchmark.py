@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+#
+# Benchmarks the analysis, interval construction and export stages on
+# synthetic recordings generated with the bundled ffmpeg, so it runs offline.
+# Every stage runs in a fresh process to get its own peak memory, results are
+# appended to a JSON lines file and compared with the previous matching run.
+#
+#   python benchmark.py --minutes 10 60 --formats wav webm
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import audio_silence_splitter as splitter
+
+FIXTURE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "audio_silence_splitter", "fixtures"
+)
+RESULTS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmark_results.jsonl"
+)
+# One minute of the synthetic recording: 20 s of speech, a 2 s pause, 15 s of
+# speech and 23 s of silence. Speech is pink noise pulsing at a syllable rate.
+SPEECH_VOLUME = (
+    "if(lt(mod(t,60),20)+between(mod(t,60),22,37),0.6+0.4*sin(2*PI*4*t),0.003)"
+)
+FIXTURE_CODECS = {".wav": "pcm_s16le", ".webm": "libopus", ".mp3": "libmp3lame"}
+# Splits the fixture at the 23 s silences, not at the 2 s pauses
+SILENCE_MIN_LEN = 0.25
+# Peak RSS (in MB) of the ffmpeg processes of a stage above which the run
+# fails. Every stage streams, so it must not grow with the recording length.
+MAX_FFMPEG_RSS_MB = 150
+
+
+def make_fixture(minutes, extension, fixture_dir=FIXTURE_DIR):
+    """Path of a synthetic speech/silence recording, generated on first use."""
+    os.makedirs(fixture_dir, exist_ok=True)
+    path = os.path.join(fixture_dir, f"speech_{minutes:g}min{extension}")
+    if os.path.exists(path):
+        return path
+    temp_path = path + ".part" + extension
+    cmd = [
+        splitter.ffmpeg_path,
+        "-v",
+        "error",
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        f"anoisesrc=d={minutes * 60}:c=pink:a=0.5:r=48000:seed=1",
+        "-af",
+        f"volume='{SPEECH_VOLUME}':eval=frame",
+        "-ac",
+        "2",
+        "-c:a",
+        FIXTURE_CODECS[extension],
+        temp_path,
+    ]
+    process = subprocess.run(cmd, stderr=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise OSError(f"Could not generate {path}: {process.stderr.strip()}")
+    os.replace(temp_path, path)
+    return path
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux, children covers the ffmpeg processes
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(self_rss / 1024, 1), round(children_rss / 1024, 1)
+
+
+def _run_stage(stage, fixture, work_dir, options):
+    # ru_maxrss of the children is the peak of any child so far, and the
+    # worker already ran one: imageio_ffmpeg runs ffmpeg -version on import.
+    # Only a stage whose own children go above that gets a peak.
+    _, baseline_rss = _peak_rss_mb()
+    levels_path = os.path.join(work_dir, "levels.npz")
+    intervals_path = os.path.join(work_dir, "intervals.npy")
+    start = time.perf_counter()
+    if stage == "analysis":
+        levels, duration = splitter.analyse_levels(
+            fixture,
+            window_size=options["window_size"],
+            logger=None,
+            streaming=options["streaming"],
+            analysis_rate=options["analysis_rate"],
+            hop_size=options["hop_size"],
+            shards=options["shards"],
+        )
+        elapsed = time.perf_counter() - start
+        np.savez(levels_path, levels=levels, duration=duration)
+    elif stage == "intervals":
+        with np.load(levels_path) as data:
+            levels, duration = data["levels"], float(data["duration"])
+        start = time.perf_counter()
+        intervals = splitter.intervals_from_levels(
+            levels,
+            duration,
+            silence_min_len=SILENCE_MIN_LEN * 60,
+            window_size=options["window_size"],
+            hop_size=options["hop_size"],
+        )
+        elapsed = time.perf_counter() - start
+        np.save(intervals_path, intervals)
+    else:
+        intervals = np.load(intervals_path)
+        clip_paths = [
+            os.path.join(work_dir, f"clip_{index}.mp3")
+            for index in range(len(intervals))
+        ]
+        start = time.perf_counter()
+        if stage == "export" and options["export_workers"] > 1:
+            splitter.export_takes(
+                fixture, intervals, clip_paths, workers=options["export_workers"]
+            )
+        elif stage == "export":
+            splitter.export_intervals(fixture, intervals, clip_paths)
+        else:
+            container = splitter.STREAM_COPY_CONTAINERS[
+                splitter.get_audio_codec(fixture)
+            ]
+            clip_paths = [os.path.splitext(p)[0] + container for p in clip_paths]
+            splitter.export_stream_copy(fixture, intervals, clip_paths)
+        elapsed = time.perf_counter() - start
+        for clip_path in clip_paths:
+            os.remove(clip_path)
+    self_rss, children_rss = _peak_rss_mb()
+    return {
+        "seconds": round(elapsed, 4),
+        "peak_rss_mb": self_rss,
+        # None when no ffmpeg of the stage went above the baseline
+        "ffmpeg_peak_rss_mb": children_rss if children_rss > baseline_rss else None,
+        "ffmpeg_baseline_rss_mb": baseline_rss,
+    }
+
+
+def benchmark_file(fixture, stages, options):
+    """Time each stage on fixture, every stage in its own process."""
+    duration = splitter.get_audio_duration(fixture)
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for stage in ["analysis", "intervals"] + stages:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=context
+            ) as pool:
+                result = pool.submit(
+                    _run_stage, stage, fixture, work_dir, options
+                ).result()
+            # Audio seconds processed per wall clock second
+            result["realtime_factor"] = round(
+                duration / max(result["seconds"], 1e-9), 1
+            )
+            results[stage] = result
+    return results
+
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    ffmpeg_version = subprocess.run(
+        [splitter.ffmpeg_path, "-version"], capture_output=True, text=True
+    ).stdout.split("\n")[0]
+    return {
+        "commit": commit,
+        "ffmpeg": ffmpeg_version,
+        "numpy": np.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _previous_run(results_file, key):
+    previous = None
+    if os.path.exists(results_file):
+        with open(results_file) as f:
+            for line in f:
+                try:
+                    run = json.loads(line)
+                except ValueError:
+                    continue
+                if run.get("key") == key:
+                    previous = run
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time analysis, interval construction and export on "
+        "synthetic recordings."
+    )
+    parser.add_argument(
+        "--minutes",
+        type=float,
+        nargs="+",
+        default=[10],
+        help="lengths of the synthetic recordings",
+    )
+    parser.add_argument(
+        "--formats", nargs="+", default=["wav", "webm"], choices=["wav", "webm", "mp3"]
+    )
+    parser.add_argument("--window-size", type=float, default=1)
+    parser.add_argument("--hop-size", type=float)
+    parser.add_argument(
+        "--analysis-rate", type=int, default=8000, help="0 for 44.1 kHz stereo"
+    )
+    parser.add_argument(
+        "--whole-track",
+        action="store_true",
+        help="decode the whole track at once instead of streaming",
+    )
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument(
+        "--export-workers",
+        type=int,
+        default=1,
+        help="encode takes in parallel, each seeking to its take",
+    )
+    parser.add_argument(
+        "--skip-export", action="store_true", help="only time analysis and intervals"
+    )
+    parser.add_argument(
+        "--max-ffmpeg-rss",
+        type=float,
+        default=MAX_FFMPEG_RSS_MB,
+        help="fail when the ffmpeg processes of a stage peak above this many MB",
+    )
+    parser.add_argument("--fixture-dir", default=FIXTURE_DIR)
+    parser.add_argument("--results", default=RESULTS_FILE)
+    args = parser.parse_args()
+
+    options = {
+        "window_size": args.window_size,
+        "hop_size": args.hop_size,
+        "analysis_rate": args.analysis_rate or None,
+        "streaming": not args.whole_track,
+        "shards": args.shards,
+        "export_workers": args.export_workers,
+    }
+    environment = _environment()
+    over_limit = []
+    for minutes in args.minutes:
+        for extension in ["." + name for name in args.formats]:
+            fixture = make_fixture(minutes, extension, args.fixture_dir)
+            stages = []
+            if not args.skip_export:
+                stages += ["export", "stream_copy"]
+            key = json.dumps(
+                {"minutes": minutes, "format": extension, **options}, sort_keys=True
+            )
+            previous = _previous_run(args.results, key)
+            results = benchmark_file(fixture, stages, options)
+
+            print(f"{os.path.basename(fixture)} {options}")
+            for stage, result in results.items():
+                ffmpeg_rss = result["ffmpeg_peak_rss_mb"]
+                line = (
+                    f"  {stage:12} {result['seconds']:9.3f} s "
+                    f"{result['realtime_factor']:9.1f}x realtime "
+                    f"{result['peak_rss_mb']:7.1f} MB "
+                    + (
+                        f"(ffmpeg {ffmpeg_rss:.1f} MB)"
+                        if ffmpeg_rss is not None
+                        else f"(ffmpeg <= {result['ffmpeg_baseline_rss_mb']:.1f} MB)"
+                    )
+                )
+                if previous and stage in previous["results"]:
+                    before = previous["results"][stage]["seconds"]
+                    change = (result["seconds"] / max(before, 1e-9) - 1) * 100
+                    line += f" {change:+.0f}% vs " + (
+                        previous["environment"]["commit"] or "previous run"
+                    )
+                if ffmpeg_rss is not None and ffmpeg_rss > args.max_ffmpeg_rss:
+                    line += " FFMPEG RSS OVER LIMIT"
+                    over_limit.append(f"{os.path.basename(fixture)} {stage}")
+                print(line)
+
+            with open(args.results, "a") as f:
+                run = {
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "key": key,
+                    "environment": environment,
+                    "results": results,
+                }
+                f.write(json.dumps(run) + "\n")
+    if over_limit:
+        raise SystemExit(
+            f"ffmpeg peak RSS above {args.max_ffmpeg_rss:g} MB: "
+            + ", ".join(over_limit)
+        )
+
+
+if __name__ == "__main__":
+    main()
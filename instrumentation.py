@@ -0,0 +1,162 @@
+"""Per-stage timings and counters of a split_file run.
+
+audio_silence_splitter counts the ffmpeg processes it starts and the bytes
+of PCM it decodes with count(), into the Instrumentation of the job running
+in the calling context. Instrumentation times named stages, attaches the
+counter increments of each stage and hands the resulting events to a
+callback and/or appends them to a JSON lines file.
+"""
+
+import collections
+import contextlib
+import contextvars
+import json
+import threading
+import time
+
+# Instrumentation of the job running in this context. Jobs sharing an event
+# loop run in tasks of their own, threads started for a job get a copy of
+# its context (contextvars.copy_context).
+_active = contextvars.ContextVar("instrumentation", default=None)
+
+
+def count(name, amount=1):
+    """Add amount to the counter name of the active Instrumentation, if any."""
+    metrics = _active.get()
+    if metrics is not None:
+        # Takes are exported from several threads at once
+        with metrics._lock:
+            metrics.counters[name] += amount
+
+
+class Instrumentation:
+    """Emits one event per stage and a final "done", "failed" or
+    "cancelled" event for file_in.
+
+    Events are dicts with "event", "file", "stage", "seconds" and the
+    counters that changed, plus "realtime_factor" for stages that know
+    how much audio they processed. on_event(event) is called for each,
+    json_path gets one JSON line per event.
+    """
+
+    def __init__(self, file_in, on_event=None, json_path=None):
+        self.file_in = file_in
+        self.on_event = on_event
+        self.json_path = json_path
+        self.events = []
+        # What count() recorded while this instrumentation was active
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def _activate(self):
+        token = _active.set(self)
+        try:
+            yield
+        finally:
+            _active.reset(token)
+
+    def _counters(self):
+        with self._lock:
+            return self.counters.copy()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the block as stage name. Yields a dict the block can add
+        fields to, e.g. "audio_seconds" or "clips". A block that raises
+        still emits its stage, with the "error"."""
+        fields = {}
+        counters_before = self._counters()
+        started = time.perf_counter()
+        try:
+            with self._activate():
+                yield fields
+        except BaseException as e:
+            # Cancelled jobs (SystemExit) and timeouts too
+            fields["error"] = _error(e)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.emit("stage", name, seconds, counters_before, fields)
+
+    @contextlib.contextmanager
+    def run(self):
+        """Wrap the whole run: emits a "done" event with the totals when the
+        block finishes, "failed" with the error when it raises, or
+        "cancelled" when it is interrupted (SystemExit from a terminated
+        job, a cancelled task, Ctrl-C). Yields a dict the block can add
+        fields to."""
+        fields = {}
+        try:
+            with self._activate():
+                yield fields
+        except Exception as e:
+            self.finish("failed", error=str(e), **fields)
+            raise
+        except BaseException as e:
+            self.finish("cancelled", error=_error(e), **fields)
+            raise
+        self.finish("done", **fields)
+
+    def finish(self, event_type="done", **fields):
+        """Emit the event with the totals of the whole run. Its audio_seconds
+        default to the ones of the analysis stage."""
+        for event in self.events:
+            if event["stage"] == "analysis" and "audio_seconds" in event:
+                fields.setdefault("audio_seconds", event["audio_seconds"])
+        seconds = time.perf_counter() - self._started
+        self.emit(event_type, None, seconds, collections.Counter(), fields)
+
+    def emit(self, event_type, stage, seconds, counters_before, fields):
+        event = {
+            "event": event_type,
+            "file": self.file_in,
+            "stage": stage,
+            "seconds": round(seconds, 4),
+            **(self._counters() - counters_before),
+            **fields,
+        }
+        if fields.get("audio_seconds"):
+            # Audio seconds processed per wall clock second
+            event["realtime_factor"] = round(
+                fields["audio_seconds"] / max(seconds, 1e-9), 1
+            )
+        self.events.append(event)
+        if self.json_path:
+            # One write per line, runs in parallel processes can share a file
+            with open(self.json_path, "a") as f:
+                f.write(json.dumps(event) + "\n")
+        if self.on_event:
+            self.on_event(event)
+
+
+def _error(e):
+    # SystemExit's message is just the exit code
+    if isinstance(e, Exception) and str(e):
+        return str(e)
+    return type(e).__name__
+
+
+def describe(event):
+    """One line summary of an event for logs."""
+    if event["stage"]:
+        text = event["stage"]
+        if "error" in event:
+            text += " failed after"
+    else:
+        text = (
+            f"{event['event']} after"
+            if event["event"] in ("failed", "cancelled")
+            else "total"
+        )
+    text += f" {event['seconds']:.2f} s"
+    if "realtime_factor" in event:
+        text += f" ({event['realtime_factor']:g}x realtime)"
+    if event.get("decoded_bytes"):
+        text += f", {event['decoded_bytes'] / 1e6:.1f} MB decoded"
+    if event.get("ffmpeg_processes"):
+        text += f", {event['ffmpeg_processes']} ffmpeg run(s)"
+    if "snap_error" in event:
+        text += f", cuts moved by up to {event['snap_error'] * 1000:.0f} ms"
+    return text
@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+from audio_silence_splitter import share_export_slots, split_file
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+# Message from a running job with an instrumentation event
+STAGE = "stage"
+
+# Manually picked files go ahead of files found by the folder watcher
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+
+class Job:
+    def __init__(self, job_id, file_path, params, priority):
+        self.id = job_id
+        self.file_path = file_path
+        self.params = params
+        self.priority = priority
+        self.state = QUEUED
+        # The dict returned by split_file once done
+        self.result = None
+        self.error = None
+        self.process = None
+        # Instrumentation events reported so far
+        self.stages = []
+
+
+def _run_job(conn, file_path, params, export_slots):
+    # Turn terminate() into an exception so the ffmpeg child processes get
+    # killed on the way out (Windows has no SIGTERM, it kills hard)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(1))
+    share_export_slots(export_slots)
+    try:
+        conn.send(
+            (
+                DONE,
+                split_file(
+                    file_in=file_path,
+                    on_stage=lambda event: conn.send((STAGE, event)),
+                    **params,
+                ),
+            )
+        )
+    except Exception as e:
+        conn.send((FAILED, str(e)))
+    finally:
+        conn.close()
+
+
+class JobScheduler:
+    """Runs split_file jobs in at most max_workers processes at a time.
+
+    Jobs wait in a priority queue (FIFO within a priority) and each runs in
+    its own process, so a running job can be cancelled by terminating it.
+    on_update(job) is called from a background thread on every state change,
+    on_stage(job, event) for every instrumentation event a job reports.
+    All jobs share export_slots (default: the number of CPUs) export ffmpeg
+    processes, see audio_silence_splitter.share_export_slots.
+    """
+
+    def __init__(
+        self, on_update=None, max_workers=None, on_stage=None, export_slots=None
+    ):
+        self.on_update = on_update
+        self.on_stage = on_stage
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.jobs = {}
+        self._queue = []
+        self._ids = itertools.count(1)
+        self._running = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        # spawn everywhere, forking a process that runs GUI threads is unsafe
+        self._context = multiprocessing.get_context("spawn")
+        self._export_slot_count = export_slots or os.cpu_count() or 1
+        self._export_slots = self._context.BoundedSemaphore(self._export_slot_count)
+        # Set when a job died without reporting, maybe holding export slots
+        self._slots_lost = False
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def submit(self, file_path, priority=PRIORITY_NORMAL, **params):
+        with self._condition:
+            job = Job(next(self._ids), file_path, params, priority)
+            self.jobs[job.id] = job
+            heapq.heappush(self._queue, (priority, job.id, job))
+            self._condition.notify_all()
+        self._notify(job)
+        return job
+
+    def cancel(self, job_id):
+        with self._condition:
+            job = self.jobs[job_id]
+            if job.state == QUEUED:
+                # Left in the heap, the dispatcher skips it
+                job.state = CANCELLED
+            elif job.state == RUNNING:
+                job.state = CANCELLED
+                job.process.terminate()
+            else:
+                return
+        self._notify(job)
+
+    def cancel_all(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+
+    def counts(self):
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+        for job in list(self.jobs.values()):
+            counts[job.state] += 1
+        return counts
+
+    def shutdown(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self.cancel_all()
+
+    def _notify(self, job):
+        if self.on_update:
+            self.on_update(job)
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._closed and (
+                    not self._queue or self._running >= self.max_workers
+                ):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                job = heapq.heappop(self._queue)[2]
+                if job.state != QUEUED:
+                    continue
+                receiver, sender = self._context.Pipe(duplex=False)
+                job.process = self._context.Process(
+                    target=_run_job,
+                    args=(sender, job.file_path, job.params, self._export_slots),
+                )
+                job.process.start()
+                sender.close()
+                job.state = RUNNING
+                self._running += 1
+            self._notify(job)
+            threading.Thread(
+                target=self._wait_for, args=(job, receiver), daemon=True
+            ).start()
+
+    def _wait_for(self, job, receiver):
+        while True:
+            try:
+                state, value = receiver.recv()
+            except EOFError:
+                # Process died without reporting (terminated or crashed)
+                state, value = FAILED, f"worker exited with code {job.process.exitcode}"
+                self._slots_lost = True
+            if state != STAGE:
+                break
+            job.stages.append(value)
+            if self.on_stage:
+                self.on_stage(job, value)
+        receiver.close()
+        job.process.join()
+        with self._condition:
+            self._running -= 1
+            if self._running == 0 and self._slots_lost:
+                # A process killed hard (terminate() on Windows) can't give
+                # back its slots, once nothing runs they are all free again
+                self._export_slots = self._context.BoundedSemaphore(
+                    self._export_slot_count
+                )
+                self._slots_lost = False
+            self._condition.notify_all()
+            if job.state == CANCELLED:
+                return
+            job.state = state
+            if state == DONE:
+                job.result = value
+            else:
+                job.error = value
+        self._notify(job)
@@ -0,0 +1,100 @@
+"""Persistent record of the files that have been split.
+
+Each finished job appends one JSON line with the fingerprint of its input
+(see analysis_cache.file_fingerprint), the parameters it ran with, the clips
+it wrote and whether it succeeded. A file whose fingerprint is recorded as
+done with the same parameters doesn't need to be split again, even after
+the application restarted.
+"""
+
+import json
+import os
+import threading
+import time
+
+from analysis_cache import CACHE_DIR, file_fingerprint
+
+LEDGER_FILE = os.path.join(CACHE_DIR, "ledger.jsonl")
+DONE = "done"
+FAILED = "failed"
+# Options that change how a file is processed but not the clips written
+EXECUTION_OPTIONS = ("shards", "use_cache", "follow", "export_workers")
+
+
+def _comparable(params):
+    # As read back from the ledger, e.g. tuples become lists
+    return json.loads(
+        json.dumps(
+            {
+                name: value
+                for name, value in params.items()
+                if name not in EXECUTION_OPTIONS
+            },
+            sort_keys=True,
+        )
+    )
+
+
+class Ledger:
+    """JSON lines ledger at path, loaded once and appended to.
+
+    Safe to use from several threads of one process.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or LEDGER_FILE
+        self._lock = threading.Lock()
+        # fingerprint -> entries, oldest first
+        self._entries = {}
+        # Paths of all clips written by jobs that are done
+        self._outputs = set()
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        self._add(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        # Line cut short by a crash while it was written
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def _add(self, entry):
+        self._entries.setdefault(entry["fingerprint"], []).append(entry)
+        if entry["status"] == DONE:
+            self._outputs.update(os.path.abspath(p) for p in entry["outputs"])
+
+    def lookup(self, fingerprint, params):
+        """The latest entry for fingerprint, if it is done with params."""
+        params = _comparable(params)
+        with self._lock:
+            for entry in reversed(self._entries.get(fingerprint, [])):
+                if entry["params"] == params:
+                    return entry if entry["status"] == DONE else None
+        return None
+
+    def is_output(self, file_path):
+        """Whether file_path is a clip written by a job that is done."""
+        with self._lock:
+            return os.path.abspath(file_path) in self._outputs
+
+    def record(
+        self, file_path, params, status, outputs=(), error=None, fingerprint=None
+    ):
+        """Append an entry for file_path, fingerprinted now unless given."""
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "file": os.path.abspath(file_path),
+            "fingerprint": fingerprint or file_fingerprint(file_path),
+            "params": _comparable(params),
+            "status": status,
+            "outputs": list(outputs),
+            "error": error,
+        }
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # One write per line so a crash can only cut off the last one
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self._add(entry)
+        return entry
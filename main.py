@@ -1,29 +1,144 @@
 import flet as ft
+import flet.canvas as cv
+import math
 import os
 import json
 import time
 import threading
+import multiprocessing
+import collections
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from audio_silence_splitter import main as process_audio, find_speaking
+import numpy as np
+from audio_silence_splitter import (
+    DETECTOR_MEASURES,
+    MEDIA_EXTENSIONS,
+    intervals_from_levels,
+)
+import pipeline
+from analysis_cache import file_fingerprint
+from instrumentation import describe
+from ledger import Ledger, DONE as LEDGER_DONE, FAILED as LEDGER_FAILED
+from jobs import (
+    JobScheduler,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    QUEUED,
+    RUNNING,
+    DONE,
+    FAILED,
+    CANCELLED,
+)
+
+# Size of the envelope drawing in the Preview tab
+PREVIEW_WIDTH = 800
+PREVIEW_HEIGHT = 200
+# Bottom of the preview's dB scale
+PREVIEW_MIN_DB = -60
+# Lines kept in the Logs tab, older ones are dropped
+LOG_MAX_LINES = 500
+# Rows of finished jobs kept in the job list
+FINISHED_JOB_ROWS = 200
+# The log and job list are redrawn at most this often, however many
+# messages arrive in between
+UI_UPDATES_PER_SECOND = 4
+# Shortest interval (in seconds) pending files are checked at, also when
+# the settle time is 0
+MIN_POLL_SECONDS = 0.1
+JOB_STATE_COLORS = {
+    QUEUED: ft.Colors.GREY_400,
+    RUNNING: ft.Colors.BLUE_300,
+    DONE: ft.Colors.GREEN_300,
+    FAILED: ft.Colors.RED_300,
+    CANCELLED: ft.Colors.ORANGE_300,
+}
 
 
 class FileEventHandler(FileSystemEventHandler):
-    def __init__(self, process_file_callback, file_extensions):
+    """Hands new files to process_file_callback once they are complete.
+
+    Files still being copied or recorded keep changing size or mtime, so a
+    file is only passed on after both stayed the same for stable_seconds.
+    With wait_until_stable=False files are passed on as soon as they have
+    content, for callbacks that follow files while they grow.
+    """
+
+    def __init__(
+        self,
+        process_file_callback,
+        file_extensions,
+        stable_seconds=5,
+        wait_until_stable=True,
+    ):
         self.process_file_callback = process_file_callback
         self.file_extensions = file_extensions
+        self.stable_seconds = stable_seconds
+        self.wait_until_stable = wait_until_stable
         self.processed_files = set()
+        # file path -> ((size, mtime), time that signature was first seen)
+        self.pending_files = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        threading.Thread(target=self._watch_pending, daemon=True).start()
 
     def on_created(self, event):
         if not event.is_directory:
-            file_path = event.src_path
-            file_ext = os.path.splitext(file_path)[1].lower()
+            self._track(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._track(event.src_path)
+
+    def on_moved(self, event):
+        # Recorders and downloads often write to a temp name and rename
+        if not event.is_directory:
+            self._track(event.dest_path)
 
+    def stop(self):
+        self._stopped.set()
+
+    def scan(self, folder_path):
+        """Track the files already in folder_path like newly created ones."""
+        for entry in sorted(os.scandir(folder_path), key=lambda e: e.name):
+            if entry.is_file():
+                self._track(entry.path)
+
+    def _track(self, file_path):
+        file_ext = os.path.splitext(file_path)[1].lower()
+        with self._lock:
             if (
                 file_ext in self.file_extensions
                 and file_path not in self.processed_files
+                and file_path not in self.pending_files
             ):
-                self.processed_files.add(file_path)
+                self.pending_files[file_path] = None
+
+    def _watch_pending(self):
+        poll_seconds = max(min(1, self.stable_seconds / 2), MIN_POLL_SECONDS)
+        while not self._stopped.wait(poll_seconds):
+            now = time.monotonic()
+            ready = []
+            with self._lock:
+                for file_path, seen in list(self.pending_files.items()):
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        # Deleted or moved away before it settled
+                        del self.pending_files[file_path]
+                        continue
+                    signature = (stat.st_size, stat.st_mtime)
+                    if self.wait_until_stable and (
+                        seen is None or seen[0] != signature
+                    ):
+                        self.pending_files[file_path] = (signature, now)
+                    elif stat.st_size and (
+                        not self.wait_until_stable
+                        or now - seen[1] >= self.stable_seconds
+                    ):
+                        del self.pending_files[file_path]
+                        self.processed_files.add(file_path)
+                        ready.append(file_path)
+            for file_path in ready:
                 self.process_file_callback(file_path)
 
 
@@ -38,20 +153,56 @@ class AudioSplitterApp:
             "trim_beg_end_only": False,
             "silence_min_len": 5,
             "volume_threshold": 0.01,
+            "detector": "peak",
+            "noise_margin_db": 10,
+            "hysteresis_db": 6,
             "window_size": 1,
+            # None: one hop per window
+            "hop_size": None,
             "ease_in": 0.6,
+            "analysis_rate": 8000,
+            "analysis_shards": 1,
+            "export_workers": 1,
             "normalization": False,
+            "stream_copy": False,
+            "follow_recordings": False,
+            "file_stable_seconds": 5,
+            "use_cache": True,
         }
         self.settings = self.load_settings()
         self.observer = None
         self.is_watching = False
         self.file_picker = None
+        self.scheduler = None
+        self.event_handler = None
+        # Files processed in earlier sessions, see process_file
+        self.ledger = Ledger()
+        # job id -> fingerprint of its input when it was queued, None for
+        # followed files that were still growing
+        self.job_fingerprints = {}
+        # Level envelope of the file analysed in the Preview tab
+        self.preview_levels = None
+        self.preview_duration = 0
+        self.preview_window_size = 1
+        self.preview_hop_size = None
+        self.preview_detector = "peak"
+        self.preview_envelope_shapes = []
+        # Analysis of the file picked last, runs on Flet's event loop
+        self.preview_task = None
+        # Newest first, drawn by _flush_ui
+        self.log_lines = collections.deque(maxlen=LOG_MAX_LINES)
+        # job id -> (row, status text) in the job list
+        self.job_rows = {}
+        # Guards log_lines and the job list against a redraw in progress
+        self._ui_lock = threading.Lock()
+        self._ui_dirty = threading.Event()
 
     def load_settings(self):
         if os.path.exists(self.settings_file):
             try:
                 with open(self.settings_file, "r") as f:
-                    return json.load(f)
+                    # Fill in settings added since the file was written
+                    return {**self.default_settings, **json.load(f)}
             except:
                 return self.default_settings.copy()
         return self.default_settings.copy()
@@ -72,22 +223,62 @@ class AudioSplitterApp:
                 if self.volume_threshold_input.value
                 else 0.01
             ),
+            "detector": self.detector_dropdown.value,
+            "noise_margin_db": float(
+                self.noise_margin_db_input.value
+                if self.noise_margin_db_input.value
+                else 10
+            ),
+            "hysteresis_db": float(
+                self.hysteresis_db_input.value if self.hysteresis_db_input.value else 6
+            ),
             "window_size": float(
                 self.window_size_input.value if self.window_size_input.value else 1
             ),
+            "hop_size": (
+                float(self.hop_size_input.value) if self.hop_size_input.value else None
+            ),
             "ease_in": float(
                 self.ease_in_input.value if self.ease_in_input.value else 0.6
             ),
+            "analysis_rate": int(
+                self.analysis_rate_input.value
+                if self.analysis_rate_input.value
+                else 8000
+            ),
+            "analysis_shards": int(
+                self.analysis_shards_input.value
+                if self.analysis_shards_input.value
+                else 1
+            ),
+            "export_workers": int(
+                self.export_workers_input.value
+                if self.export_workers_input.value
+                else 1
+            ),
             "normalization": self.normalization_checkbox.value,
+            "stream_copy": self.stream_copy_checkbox.value,
+            "follow_recordings": self.follow_recordings_checkbox.value,
+            "file_stable_seconds": float(
+                self.file_stable_seconds_input.value
+                if self.file_stable_seconds_input.value
+                else 5
+            ),
+            "use_cache": self.use_cache_checkbox.value,
         }
 
         with open(self.settings_file, "w") as f:
             json.dump(settings_to_save, f)
 
-    def process_file(self, file_path):
-        try:
-            self.add_log(f"Processing file: {os.path.basename(file_path)}")
+    def process_file(
+        self, file_path, priority=PRIORITY_NORMAL, follow=False, skip_processed=True
+    ):
+        """Queue file_path with the current settings.
 
+        With skip_processed, files the ledger has as done with the same
+        settings and clips written by earlier jobs are skipped.
+        """
+        try:
             # Get settings from UI
             output_folder = self.output_folder_text.value
             trim_beg_end_only = self.trim_beg_end_checkbox.value
@@ -101,13 +292,42 @@ class AudioSplitterApp:
                 if self.volume_threshold_input.value
                 else 0.01
             )
+            detector = self.detector_dropdown.value
+            noise_margin_db = float(
+                self.noise_margin_db_input.value
+                if self.noise_margin_db_input.value
+                else 10
+            )
+            hysteresis_db = float(
+                self.hysteresis_db_input.value if self.hysteresis_db_input.value else 6
+            )
             window_size = float(
                 self.window_size_input.value if self.window_size_input.value else 1
             )
+            hop_size = (
+                float(self.hop_size_input.value) if self.hop_size_input.value else None
+            )
             ease_in = float(
                 self.ease_in_input.value if self.ease_in_input.value else 0.6
             )
+            analysis_rate = int(
+                self.analysis_rate_input.value
+                if self.analysis_rate_input.value
+                else 8000
+            )
+            analysis_shards = int(
+                self.analysis_shards_input.value
+                if self.analysis_shards_input.value
+                else 1
+            )
+            export_workers = int(
+                self.export_workers_input.value
+                if self.export_workers_input.value
+                else 1
+            )
             normalization = self.normalization_checkbox.value
+            stream_copy = self.stream_copy_checkbox.value
+            use_cache = self.use_cache_checkbox.value
 
             # Create output folder if it doesn't exist
             if output_folder and not os.path.exists(output_folder):
@@ -146,60 +366,148 @@ class AudioSplitterApp:
                 self.add_log(f"Skipping file {file_path}, output file already exists")
                 return
 
-            # Process the file using the main function from audio_silence_splitter
-            # Run in a separate thread to avoid blocking the UI
-            threading.Thread(
-                target=self._process_file_thread,
-                args=(
-                    file_path,
-                    output_path,
-                    trim_beg_end_only,
-                    silence_min_len,
-                    volume_threshold,
-                    window_size,
-                    ease_in,
-                    normalization,
-                ),
-                daemon=True,
-            ).start()
-
-        except Exception as e:
-            self.add_log(
-                f"Error setting up processing for {os.path.basename(file_path)}: {str(e)}"
-            )
-
-    def _process_file_thread(
-        self,
-        file_path,
-        output_path,
-        beg_end_only,
-        silence_min_len,
-        volume_threshold,
-        window_size,
-        ease_in,
-        normalization,
-    ):
-        try:
-            # Call the main function from audio_silence_splitter
-            result_folder = process_audio(
-                file_in=file_path,
+            params = dict(
                 output_path=output_path,
                 NORMALIZATION=normalization,
-                BEG_END_only=beg_end_only,
+                BEG_END_only=trim_beg_end_only,
                 silence_min_len=silence_min_len,
                 volume_threshold=volume_threshold,
+                detector=detector,
+                noise_margin_db=noise_margin_db,
+                hysteresis_db=hysteresis_db,
                 window_size=window_size,
+                hop_size=hop_size,
                 ease_in=ease_in,
+                analysis_rate=analysis_rate,
+                shards=analysis_shards,
+                export_workers=export_workers,
+                stream_copy=stream_copy,
+                follow=follow,
+                use_cache=use_cache,
             )
+            fingerprint = file_fingerprint(file_path)
+            if skip_processed:
+                if self.ledger.is_output(file_path):
+                    return
+                entry = self.ledger.lookup(fingerprint, params)
+                if entry:
+                    self.add_log(
+                        f"Skipping file {file_path}, already processed "
+                        f"on {entry['time']}"
+                    )
+                    return
 
-            # Log completion
-            # Need to use page.update since we're in a different thread
+            # Queue the file, the scheduler runs it in a worker process
+            job = self.scheduler.submit(file_path, priority=priority, **params)
+            # A followed file keeps growing, fingerprint it once it's done
+            self.job_fingerprints[job.id] = None if follow else fingerprint
+
+        except Exception as e:
             self.add_log(
-                f"Completed processing: {os.path.basename(file_path)} → {result_folder}"
+                f"Error setting up processing for {os.path.basename(file_path)}: {str(e)}"
             )
 
-        except Exception as e:
-            self.add_log(f"Error processing {os.path.basename(file_path)}: {str(e)}")
+    def on_job_update(self, job):
+        # Called from the scheduler's threads. Every state change shows in
+        # the job list, only how a job ended goes to the log as well
+        if job.state == QUEUED:
+            status = "Queued"
+        elif job.state == RUNNING:
+            status = "Processing"
+        elif job.state == DONE:
+            if job.result["clips"]:
+                status = (
+                    f"Completed, {len(job.result['clips'])} clip(s) "
+                    f"→ {job.result['output_folder']}"
+                )
+                if "snap_error" in job.result:
+                    status += (
+                        f", cuts moved to packets by up to "
+                        f"{job.result['snap_error'] * 1000:.0f} ms"
+                    )
+            else:
+                status = "Completed, audio was silent"
+        elif job.state == FAILED:
+            status = f"Error: {job.error}"
+        else:
+            status = "Cancelled"
+        self.set_job_status(job, status)
+        if job.state not in (QUEUED, RUNNING):
+            self.add_log(f"[job {job.id}] {os.path.basename(job.file_path)}: {status}")
+        if job.state in (DONE, FAILED):
+            self.record_job(job)
+
+    def record_job(self, job):
+        fingerprint = self.job_fingerprints.pop(job.id, None)
+        try:
+            if job.state == DONE:
+                self.ledger.record(
+                    job.file_path,
+                    job.params,
+                    LEDGER_DONE,
+                    outputs=job.result["clips"],
+                    fingerprint=fingerprint,
+                )
+            else:
+                self.ledger.record(
+                    job.file_path,
+                    job.params,
+                    LEDGER_FAILED,
+                    error=job.error,
+                    fingerprint=fingerprint,
+                )
+        except OSError as e:
+            self.add_log(f"Could not record {job.file_path} in the ledger: {e}")
+
+    def on_job_stage(self, job, event):
+        # Called from the scheduler's threads
+        self.set_job_status(job, f"Processing, {describe(event)}")
+
+    def set_job_status(self, job, status):
+        """Show status in the job's row of the job list, adding the row for
+        a new job. Safe from any thread, _flush_ui draws it."""
+        with self._ui_lock:
+            if job.id not in self.job_rows:
+                status_text = ft.Text(expand=True, no_wrap=True)
+                row = ft.Row(
+                    [
+                        ft.Text(
+                            f"[{job.id}] {os.path.basename(job.file_path)}",
+                            width=260,
+                            no_wrap=True,
+                            tooltip=job.file_path,
+                        ),
+                        status_text,
+                    ]
+                )
+                self.job_rows[job.id] = (row, status_text)
+                self.jobs_list.controls.insert(0, row)
+            status_text = self.job_rows[job.id][1]
+            status_text.value = status
+            status_text.color = JOB_STATE_COLORS[job.state]
+            if job.state in (DONE, FAILED, CANCELLED):
+                self._drop_finished_rows()
+            counts = self.scheduler.counts()
+            self.job_counts_text.value = ", ".join(
+                f"{counts[state]} {state}"
+                for state in (RUNNING, QUEUED, DONE, FAILED, CANCELLED)
+            )
+        self._ui_dirty.set()
+
+    def _drop_finished_rows(self):
+        # Oldest first, rows are added in job order
+        finished = [
+            job_id
+            for job_id in self.job_rows
+            if self.scheduler.jobs[job_id].state in (DONE, FAILED, CANCELLED)
+        ]
+        for job_id in finished[: max(len(finished) - FINISHED_JOB_ROWS, 0)]:
+            row, _ = self.job_rows.pop(job_id)
+            self.jobs_list.controls.remove(row)
+
+    def cancel_jobs(self, e):
+        self.add_log("Cancelling all queued and running jobs")
+        self.scheduler.cancel_all()
 
     def start_watching(self):
         if self.is_watching:
@@ -213,12 +521,26 @@ class AudioSplitterApp:
 
         try:
             self.observer = Observer()
-            event_handler = FileEventHandler(
-                self.process_file,
-                [".mp4", ".webm", ".mov", ".avi", ".mp3", ".wav", ".ogg", ".flac"],
+            stable_seconds = float(
+                self.file_stable_seconds_input.value
+                if self.file_stable_seconds_input.value
+                else 5
             )
-            self.observer.schedule(event_handler, folder_path, recursive=False)
+            follow = self.follow_recordings_checkbox.value
+            self.event_handler = FileEventHandler(
+                (
+                    (lambda file_path: self.process_file(file_path, follow=True))
+                    if follow
+                    else self.process_file
+                ),
+                MEDIA_EXTENSIONS,
+                stable_seconds,
+                wait_until_stable=not follow,
+            )
+            self.observer.schedule(self.event_handler, folder_path, recursive=False)
             self.observer.start()
+            # Files added while not watching, the ledger skips processed ones
+            self.event_handler.scan(folder_path)
             self.is_watching = True
             self.watch_button.text = "Stop Watching"
             self.watch_button.bgcolor = ft.Colors.RED_400
@@ -235,6 +557,8 @@ class AudioSplitterApp:
             self.observer.stop()
             self.observer.join()
             self.observer = None
+            self.event_handler.stop()
+            self.event_handler = None
             self.is_watching = False
             self.watch_button.text = "Start Watching"
             self.watch_button.bgcolor = ft.Colors.BLUE_400
@@ -268,7 +592,9 @@ class AudioSplitterApp:
         def update_file_field(result):
             if result is not None and result.files:
                 for file_path in result.files:
-                    self.process_file(file_path.path)
+                    self.process_file(
+                        file_path.path, PRIORITY_HIGH, skip_processed=False
+                    )
 
         if not self.file_picker:
             self.file_picker = ft.FilePicker(on_result=update_file_field)
@@ -290,10 +616,197 @@ class AudioSplitterApp:
             allow_multiple=True,
         )
 
+    def pick_preview_file(self, e):
+        def analyse_file(result):
+            if result is not None and result.files:
+                if self.preview_task:
+                    # Kills the ffmpeg process of a file still being analysed
+                    self.preview_task.cancel()
+                self.preview_task = self.page.run_task(
+                    self._analyse_preview, result.files[0].path
+                )
+
+        if not self.file_picker:
+            self.file_picker = ft.FilePicker(on_result=analyse_file)
+            self.page.overlay.append(self.file_picker)
+            self.page.update()
+
+        self.file_picker.on_result = analyse_file
+        self.file_picker.pick_files(
+            allowed_extensions=[
+                "mp4",
+                "webm",
+                "mov",
+                "avi",
+                "mp3",
+                "wav",
+                "ogg",
+                "flac",
+            ],
+            allow_multiple=False,
+        )
+
+    async def _analyse_preview(self, file_path):
+        name = os.path.basename(file_path)
+        self.preview_file_text.value = f"Analysing {name}..."
+        self.page.update()
+        window_size = float(
+            self.window_size_input.value if self.window_size_input.value else 1
+        )
+        hop_size = (
+            float(self.hop_size_input.value) if self.hop_size_input.value else None
+        )
+        detector = self.detector_dropdown.value
+        try:
+            levels, duration = await pipeline.analyse_levels(
+                file_path,
+                window_size=window_size,
+                hop_size=hop_size,
+                analysis_rate=int(
+                    self.analysis_rate_input.value
+                    if self.analysis_rate_input.value
+                    else 8000
+                ),
+                use_cache=self.use_cache_checkbox.value,
+                measure=DETECTOR_MEASURES[detector],
+            )
+        except Exception as e:
+            self.preview_file_text.value = f"Could not analyse {name}"
+            self.add_log(f"Error analysing {name}: {str(e)}")
+            return
+
+        self.preview_levels = levels
+        self.preview_duration = duration
+        self.preview_window_size = window_size
+        self.preview_hop_size = hop_size
+        self.preview_detector = detector
+        self.preview_envelope_shapes = self._envelope_shapes(levels)
+        self.preview_file_text.value = f"{name} ({duration / 60:.1f} min)"
+        self.update_preview()
+
+    def _envelope_shapes(self, levels):
+        # One vertical line per pixel column, the loudest window in it on a
+        # dB scale
+        columns = min(len(levels), PREVIEW_WIDTH)
+        if columns == 0:
+            return []
+        edges = np.linspace(0, len(levels), columns + 1).astype(int)[:-1]
+        peaks = np.maximum.reduceat(levels, edges)
+        db = 20 * np.log10(np.maximum(peaks, 10 ** (PREVIEW_MIN_DB / 20)))
+        paint = ft.Paint(color=ft.Colors.BLUE_200, stroke_width=1)
+        return [
+            cv.Line(
+                x,
+                PREVIEW_HEIGHT,
+                x,
+                PREVIEW_HEIGHT * value / PREVIEW_MIN_DB,
+                paint=paint,
+            )
+            for x, value in zip(
+                np.linspace(0, PREVIEW_WIDTH, columns, endpoint=False), db
+            )
+        ]
+
+    def update_preview(self, e=None):
+        self.preview_threshold_slider.label = (
+            f"{10 ** (self.preview_threshold_slider.value / 20):.4f}"
+        )
+        if self.preview_levels is None:
+            self.page.update()
+            return
+
+        volume_threshold = 10 ** (self.preview_threshold_slider.value / 20)
+        intervals = intervals_from_levels(
+            self.preview_levels,
+            self.preview_duration,
+            BEG_END_only=self.trim_beg_end_checkbox.value,
+            silence_min_len=self.preview_silence_slider.value * 60,
+            volume_threshold=volume_threshold,
+            window_size=self.preview_window_size,
+            ease_in=self.preview_ease_in_slider.value,
+            hop_size=self.preview_hop_size,
+            detector=self.preview_detector,
+            noise_margin_db=float(
+                self.noise_margin_db_input.value
+                if self.noise_margin_db_input.value
+                else 10
+            ),
+            hysteresis_db=float(
+                self.hysteresis_db_input.value if self.hysteresis_db_input.value else 6
+            ),
+        )
+
+        scale = PREVIEW_WIDTH / max(self.preview_duration, 1e-9)
+        take_paint = ft.Paint(
+            color=ft.Colors.with_opacity(0.3, ft.Colors.GREEN),
+            style=ft.PaintingStyle.FILL,
+        )
+        take_shapes = [
+            cv.Rect(
+                max(start, 0) * scale,
+                0,
+                (end - max(start, 0)) * scale,
+                PREVIEW_HEIGHT,
+                paint=take_paint,
+            )
+            for start, end in intervals
+        ]
+        threshold_y = (
+            PREVIEW_HEIGHT * self.preview_threshold_slider.value / PREVIEW_MIN_DB
+        )
+        threshold_line = cv.Line(
+            0,
+            threshold_y,
+            PREVIEW_WIDTH,
+            threshold_y,
+            paint=ft.Paint(color=ft.Colors.RED_400, stroke_width=1),
+        )
+        self.preview_canvas.shapes = (
+            take_shapes + self.preview_envelope_shapes + [threshold_line]
+        )
+
+        kept = sum(end - max(start, 0) for start, end in intervals)
+        self.preview_summary_text.value = (
+            f"{len(intervals)} take(s), keeping {kept / 60:.1f} of "
+            f"{self.preview_duration / 60:.1f} min"
+        )
+        self.page.update()
+
+    def apply_preview_settings(self, e):
+        self.volume_threshold_input.value = (
+            f"{10 ** (self.preview_threshold_slider.value / 20):.4f}"
+        )
+        self.silence_min_len_input.value = str(self.preview_silence_slider.value)
+        self.ease_in_input.value = str(self.preview_ease_in_slider.value)
+        self.save_settings()
+        self.page.update()
+        self.add_log("Applied preview settings")
+
     def add_log(self, message):
+        # Safe from any thread, _flush_ui draws it
         current_time = time.strftime("%H:%M:%S")
-        self.log_text.value = f"{current_time} - {message}\n" + self.log_text.value
-        self.page.update()
+        with self._ui_lock:
+            self.log_lines.appendleft(f"{current_time} - {message}")
+        self._ui_dirty.set()
+
+    def clear_log(self, e):
+        with self._ui_lock:
+            self.log_lines.clear()
+        self._ui_dirty.set()
+
+    def _flush_ui(self):
+        # Redraw the log and job list once for everything that changed since
+        # the last redraw, instead of once per message
+        while True:
+            self._ui_dirty.wait()
+            time.sleep(1 / UI_UPDATES_PER_SECOND)
+            self._ui_dirty.clear()
+            with self._ui_lock:
+                self.log_text.value = "\n".join(self.log_lines)
+                try:
+                    self.page.update()
+                except Exception as e:
+                    print(f"Could not update the window: {e}")
 
     def init_ui(self, page):
         self.page = page
@@ -336,7 +849,24 @@ class AudioSplitterApp:
         self.normalization_checkbox = ft.Checkbox(
             label="Apply Audio Normalization",
             value=self.settings["normalization"],
-            tooltip="Apply audio normalization during processing",
+            tooltip="Bring every take to the same loudness with a static gain, "
+            "measured during analysis. A low analysis rate leaves out the highs, "
+            "making takes come out a little loud.",
+        )
+
+        self.stream_copy_checkbox = ft.Checkbox(
+            label="Fast Export (No Re-encoding)",
+            value=self.settings["stream_copy"],
+            tooltip="Cut without re-encoding, keeping the source codec instead of MP3. "
+            "Cuts move to the nearest audio packet. Ignored when normalizing.",
+        )
+
+        self.follow_recordings_checkbox = ft.Checkbox(
+            label="Split While Recording",
+            value=self.settings["follow_recordings"],
+            tooltip="Watched files are split while they are still being written, "
+            "each take is exported as soon as the silence after it is long enough. "
+            "Uses the peak or RMS detector and MP3 export.",
         )
 
         self.watch_button = ft.ElevatedButton(
@@ -363,6 +893,8 @@ class AudioSplitterApp:
             max_lines=12,
             expand=True,
         )
+        self.job_counts_text = ft.Text()
+        self.jobs_list = ft.ListView(height=200, spacing=2)
 
         # Advanced settings - numeric inputs instead of sliders
         self.silence_min_len_input = ft.TextField(
@@ -383,6 +915,36 @@ class AudioSplitterApp:
             hint_text="0.01",
         )
 
+        self.detector_dropdown = ft.Dropdown(
+            label="Silence Detector",
+            value=self.settings["detector"],
+            options=[
+                ft.dropdown.Option("peak", "Peak level"),
+                ft.dropdown.Option("rms", "RMS level"),
+                ft.dropdown.Option("adaptive", "Adaptive noise floor"),
+                ft.dropdown.Option("hysteresis", "RMS with hysteresis"),
+            ],
+            width=150,
+        )
+
+        self.noise_margin_db_input = ft.TextField(
+            label="Noise Margin (dB)",
+            value=str(self.settings["noise_margin_db"]),
+            keyboard_type=ft.KeyboardType.NUMBER,
+            text_align=ft.TextAlign.RIGHT,
+            width=150,
+            hint_text="10",
+        )
+
+        self.hysteresis_db_input = ft.TextField(
+            label="Hysteresis (dB)",
+            value=str(self.settings["hysteresis_db"]),
+            keyboard_type=ft.KeyboardType.NUMBER,
+            text_align=ft.TextAlign.RIGHT,
+            width=150,
+            hint_text="6",
+        )
+
         self.window_size_input = ft.TextField(
             label="Window Size (seconds)",
             value=str(self.settings["window_size"]),
@@ -392,6 +954,19 @@ class AudioSplitterApp:
             hint_text="1.0",
         )
 
+        self.hop_size_input = ft.TextField(
+            label="Hop Size (seconds)",
+            value=(
+                ""
+                if self.settings["hop_size"] is None
+                else str(self.settings["hop_size"])
+            ),
+            keyboard_type=ft.KeyboardType.NUMBER,
+            text_align=ft.TextAlign.RIGHT,
+            width=150,
+            hint_text="Window size",
+        )
+
         self.ease_in_input = ft.TextField(
             label="Ease In/Out (seconds)",
             value=str(self.settings["ease_in"]),
@@ -401,6 +976,88 @@ class AudioSplitterApp:
             hint_text="0.6",
         )
 
+        self.analysis_rate_input = ft.TextField(
+            label="Analysis Sample Rate (Hz)",
+            value=str(self.settings["analysis_rate"]),
+            keyboard_type=ft.KeyboardType.NUMBER,
+            text_align=ft.TextAlign.RIGHT,
+            width=150,
+            hint_text="8000",
+        )
+
+        self.analysis_shards_input = ft.TextField(
+            label="Analysis Processes",
+            value=str(self.settings["analysis_shards"]),
+            keyboard_type=ft.KeyboardType.NUMBER,
+            text_align=ft.TextAlign.RIGHT,
+            width=150,
+            hint_text="1",
+        )
+
+        self.export_workers_input = ft.TextField(
+            label="Export Processes",
+            value=str(self.settings["export_workers"]),
+            keyboard_type=ft.KeyboardType.NUMBER,
+            text_align=ft.TextAlign.RIGHT,
+            width=150,
+            hint_text="1",
+        )
+
+        self.file_stable_seconds_input = ft.TextField(
+            label="File Settle Time (seconds)",
+            value=str(self.settings["file_stable_seconds"]),
+            keyboard_type=ft.KeyboardType.NUMBER,
+            text_align=ft.TextAlign.RIGHT,
+            width=150,
+            hint_text="5",
+        )
+
+        self.use_cache_checkbox = ft.Checkbox(
+            label="Cache Analysis Results",
+            value=self.settings["use_cache"],
+            tooltip="Keep the analysed volume levels on disk, so reprocessing a file "
+            "with other thresholds skips decoding it again",
+        )
+
+        # Preview - sliders rederive the takes from the analysed levels
+        self.preview_file_text = ft.Text("No file analysed yet", italic=True)
+        self.preview_threshold_slider = ft.Slider(
+            min=PREVIEW_MIN_DB,
+            max=0,
+            divisions=120,
+            value=max(
+                20 * math.log10(max(self.settings["volume_threshold"], 1e-9)),
+                PREVIEW_MIN_DB,
+            ),
+            label=f"{self.settings['volume_threshold']:.4f}",
+            on_change=self.update_preview,
+            expand=True,
+        )
+        self.preview_silence_slider = ft.Slider(
+            min=0,
+            max=10,
+            divisions=100,
+            round=1,
+            value=min(self.settings["silence_min_len"], 10),
+            label="{value} min",
+            on_change=self.update_preview,
+            expand=True,
+        )
+        self.preview_ease_in_slider = ft.Slider(
+            min=0,
+            max=3,
+            divisions=30,
+            round=1,
+            value=min(self.settings["ease_in"], 3),
+            label="{value} s",
+            on_change=self.update_preview,
+            expand=True,
+        )
+        self.preview_canvas = cv.Canvas(
+            shapes=[], width=PREVIEW_WIDTH, height=PREVIEW_HEIGHT
+        )
+        self.preview_summary_text = ft.Text("")
+
         # Set up tabs
         tabs = ft.Tabs(
             selected_index=0,
@@ -441,6 +1098,8 @@ class AudioSplitterApp:
                                     [
                                         self.trim_beg_end_checkbox,
                                         self.normalization_checkbox,
+                                        self.stream_copy_checkbox,
+                                        self.follow_recordings_checkbox,
                                     ]
                                 ),
                                 ft.Row([self.watch_button, self.process_file_button]),
@@ -482,6 +1141,39 @@ class AudioSplitterApp:
                                     ]
                                 ),
                                 ft.Divider(),
+                                ft.Row(
+                                    [
+                                        self.detector_dropdown,
+                                        ft.Text(
+                                            "Level compared against the threshold. Adaptive raises the threshold to the file's noise floor, hysteresis keeps speech on until the level drops further",
+                                            size=12,
+                                            italic=True,
+                                        ),
+                                    ]
+                                ),
+                                ft.Divider(),
+                                ft.Row(
+                                    [
+                                        self.noise_margin_db_input,
+                                        ft.Text(
+                                            "Adaptive detector: speech must be this much louder than the noise floor",
+                                            size=12,
+                                            italic=True,
+                                        ),
+                                    ]
+                                ),
+                                ft.Divider(),
+                                ft.Row(
+                                    [
+                                        self.hysteresis_db_input,
+                                        ft.Text(
+                                            "Hysteresis detector: speech stops this far below the threshold",
+                                            size=12,
+                                            italic=True,
+                                        ),
+                                    ]
+                                ),
+                                ft.Divider(),
                                 ft.Row(
                                     [
                                         self.window_size_input,
@@ -493,6 +1185,17 @@ class AudioSplitterApp:
                                     ]
                                 ),
                                 ft.Divider(),
+                                ft.Row(
+                                    [
+                                        self.hop_size_input,
+                                        ft.Text(
+                                            "Time between window starts, smaller than the window size for overlapping windows and finer cuts",
+                                            size=12,
+                                            italic=True,
+                                        ),
+                                    ]
+                                ),
+                                ft.Divider(),
                                 ft.Row(
                                     [
                                         self.ease_in_input,
@@ -503,11 +1206,109 @@ class AudioSplitterApp:
                                         ),
                                     ]
                                 ),
+                                ft.Divider(),
+                                ft.Row(
+                                    [
+                                        self.analysis_rate_input,
+                                        ft.Text(
+                                            "Audio is downmixed to mono at this rate for silence detection",
+                                            size=12,
+                                            italic=True,
+                                        ),
+                                    ]
+                                ),
+                                ft.Divider(),
+                                ft.Row(
+                                    [
+                                        self.analysis_shards_input,
+                                        ft.Text(
+                                            "Long files are split into this many parts analysed in parallel",
+                                            size=12,
+                                            italic=True,
+                                        ),
+                                    ]
+                                ),
+                                ft.Divider(),
+                                ft.Row(
+                                    [
+                                        self.export_workers_input,
+                                        ft.Text(
+                                            "Takes of a file encoded in parallel, all jobs together use at most one per CPU",
+                                            size=12,
+                                            italic=True,
+                                        ),
+                                    ]
+                                ),
+                                ft.Divider(),
+                                ft.Row(
+                                    [
+                                        self.file_stable_seconds_input,
+                                        ft.Text(
+                                            "Watched files are processed once they stopped changing for this long",
+                                            size=12,
+                                            italic=True,
+                                        ),
+                                    ]
+                                ),
+                                ft.Divider(),
+                                self.use_cache_checkbox,
                                 ft.FilledButton(
                                     text="Save Settings",
                                     on_click=lambda _: self.save_settings(),
                                 ),
-                            ]
+                            ],
+                            scroll=ft.ScrollMode.AUTO,
+                        ),
+                        padding=20,
+                    ),
+                ),
+                ft.Tab(
+                    text="Preview",
+                    icon=ft.Icons.GRAPHIC_EQ,
+                    content=ft.Container(
+                        content=ft.Column(
+                            [
+                                ft.Row(
+                                    [
+                                        ft.FilledButton(
+                                            text="Analyse File",
+                                            icon=ft.Icons.FILE_OPEN,
+                                            on_click=self.pick_preview_file,
+                                        ),
+                                        self.preview_file_text,
+                                    ]
+                                ),
+                                ft.Container(
+                                    content=self.preview_canvas,
+                                    bgcolor=ft.Colors.BLACK,
+                                    width=PREVIEW_WIDTH,
+                                    height=PREVIEW_HEIGHT,
+                                ),
+                                self.preview_summary_text,
+                                ft.Row(
+                                    [
+                                        ft.Text("Volume Threshold", width=180),
+                                        self.preview_threshold_slider,
+                                    ]
+                                ),
+                                ft.Row(
+                                    [
+                                        ft.Text("Silence Minimum Length", width=180),
+                                        self.preview_silence_slider,
+                                    ]
+                                ),
+                                ft.Row(
+                                    [
+                                        ft.Text("Ease In/Out", width=180),
+                                        self.preview_ease_in_slider,
+                                    ]
+                                ),
+                                ft.FilledButton(
+                                    text="Use These Settings",
+                                    on_click=self.apply_preview_settings,
+                                ),
+                            ],
+                            scroll=ft.ScrollMode.AUTO,
                         ),
                         padding=20,
                     ),
@@ -518,13 +1319,20 @@ class AudioSplitterApp:
                     content=ft.Container(
                         content=ft.Column(
                             [
+                                self.job_counts_text,
+                                self.jobs_list,
                                 self.log_text,
-                                ft.FilledButton(
-                                    text="Clear Log",
-                                    on_click=lambda _: setattr(
-                                        self.log_text, "value", ""
-                                    )
-                                    or self.page.update(),
+                                ft.Row(
+                                    [
+                                        ft.FilledButton(
+                                            text="Clear Log",
+                                            on_click=self.clear_log,
+                                        ),
+                                        ft.FilledButton(
+                                            text="Cancel All Jobs",
+                                            on_click=self.cancel_jobs,
+                                        ),
+                                    ]
                                 ),
                             ]
                         ),
@@ -548,13 +1356,25 @@ class AudioSplitterApp:
         self.file_picker = ft.FilePicker()
         page.overlay.append(self.file_picker)
 
+        # Jobs run in a pool of worker processes, one per core
+        self.scheduler = JobScheduler(
+            on_update=self.on_job_update, on_stage=self.on_job_stage
+        )
+
+        threading.Thread(target=self._flush_ui, daemon=True).start()
         # Add initial log entry
         self.add_log("Application started")
 
     def main(self):
-        ft.app(target=self.init_ui)
+        try:
+            ft.app(target=self.init_ui)
+        finally:
+            if self.scheduler:
+                self.scheduler.shutdown()
 
 
 if __name__ == "__main__":
+    # Needed for the worker processes in the PyInstaller build
+    multiprocessing.freeze_support()
     app = AudioSplitterApp()
     app.main()
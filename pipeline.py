@@ -0,0 +1,340 @@
+"""Asyncio version of split_file and the analysis behind it.
+
+process() runs the same stages as audio_silence_splitter.split_file, but
+drives ffmpeg with asyncio subprocesses instead of blocking on them. Jobs
+can share one event loop (e.g. Flet's), a job is cancelled by cancelling
+its task, and an ffmpeg process that writes nothing for idle_timeout
+seconds counts as stalled. In all three cases the ffmpeg process is killed
+rather than left running.
+"""
+
+import asyncio
+import contextlib
+import subprocess
+import tempfile
+
+import numpy as np
+
+import audio_silence_splitter as splitter
+import instrumentation
+
+# Seconds without output after which an ffmpeg process is given up on
+IDLE_TIMEOUT_SECONDS = 60
+# Bytes read at a time from an ffmpeg process that doesn't write PCM
+READ_BYTES = 64 * 1024
+
+
+@contextlib.asynccontextmanager
+async def _ffmpeg(cmd):
+    # stderr goes to a file so a chatty ffmpeg can never block on a full pipe
+    with tempfile.TemporaryFile() as stderr:
+        instrumentation.count("ffmpeg_processes")
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+        )
+        try:
+            yield process, stderr
+        finally:
+            # Cancelled, timed out or failed while reading
+            if process.returncode is None:
+                process.kill()
+            # Not wait(), it only returns once stdout is closed, which never
+            # happens while reading is paused on a full buffer
+            await process.communicate()
+
+
+async def _read(read, idle_timeout):
+    # Not wait_for, before Python 3.12 it can swallow a cancellation that
+    # arrives just as the read completes
+    try:
+        async with asyncio.timeout(idle_timeout):
+            return await read
+    except TimeoutError:
+        raise TimeoutError(
+            f"ffmpeg stalled, no output for {idle_timeout:g} s"
+        ) from None
+
+
+def _errors(stderr):
+    stderr.seek(0)
+    return stderr.read().decode(errors="replace").strip()
+
+
+async def run_ffmpeg(cmd, idle_timeout=IDLE_TIMEOUT_SECONDS, progress=False):
+    """Run cmd to the end and return its exit code, stdout and stderr.
+
+    With progress, ffmpeg reports its progress on stdout (which is then not
+    returned), so that encoding to files doesn't count as stalled.
+    """
+    if progress:
+        cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    output = []
+    async with _ffmpeg(cmd) as (process, stderr):
+        while True:
+            data = await _read(process.stdout.read(READ_BYTES), idle_timeout)
+            if not data:
+                break
+            if not progress:
+                output.append(data)
+        returncode = await process.wait()
+        errors = _errors(stderr)
+    return returncode, b"".join(output).decode(errors="replace"), errors
+
+
+async def open_source(file_in, idle_timeout=IDLE_TIMEOUT_SECONDS):
+    """AudioSource of file_in, with the header probed without blocking."""
+    if isinstance(file_in, splitter.AudioSource):
+        return file_in
+    _, _, output = await run_ffmpeg(splitter._header_cmd(file_in), idle_timeout)
+    return splitter.AudioSource(file_in, splitter._parse_header(output))
+
+
+async def _stream_levels(
+    file_in, hop_samples, sample_rate, channels, idle_timeout, loudness=False
+):
+    # Async _stream_levels, the levels of a chunk are computed in the event
+    # loop, a few milliseconds each
+    stream = splitter._LevelStream(hop_samples, sample_rate, loudness)
+    chunk_bytes = stream.chunk_samples * channels * 2
+    cmd = splitter._decode_cmd(file_in, sample_rate, channels)
+    async with _ffmpeg(cmd) as (process, stderr):
+        while True:
+            try:
+                data = await _read(
+                    process.stdout.readexactly(chunk_bytes), idle_timeout
+                )
+            except asyncio.IncompleteReadError as e:
+                data = e.partial
+            if not data:
+                break
+            instrumentation.count("decoded_bytes", len(data))
+            # Drop a trailing partial sample frame, it can't be reshaped
+            data = data[: len(data) - len(data) % (channels * 2)]
+            stream.feed(np.frombuffer(data, dtype=np.int16).reshape(-1, channels))
+        if await process.wait() != 0:
+            raise OSError(f"Could not decode audio from {file_in}: {_errors(stderr)}")
+    return stream.result()
+
+
+async def analyse_levels(
+    file_in,
+    window_size=1,
+    analysis_rate=None,
+    use_cache=False,
+    hop_size=None,
+    measure="peak",
+    idle_timeout=IDLE_TIMEOUT_SECONDS,
+    loudness=False,
+):
+    """Async analyse_levels, always streaming in a single process."""
+    if measure not in ("peak", "rms"):
+        raise ValueError(f"Unknown level measure {measure!r}")
+    sample_rate, channels, hop_samples, frame_length = splitter._analysis_format(
+        window_size, hop_size, analysis_rate
+    )
+    # Shares the entries of analyse_levels
+    cached = None
+    if use_cache:
+        cached = splitter._load_analysis(
+            file_in, hop_samples, sample_rate, channels, loudness
+        )
+    if cached is not None:
+        hop_levels, duration, steps = cached
+    else:
+        hop_levels, decoded_samples, meter = await _stream_levels(
+            file_in, hop_samples, sample_rate, channels, idle_timeout, loudness
+        )
+        duration = decoded_samples / sample_rate
+        steps = meter.steps if loudness else None
+        if use_cache:
+            splitter._store_analysis(
+                file_in, hop_samples, sample_rate, channels, hop_levels, duration, steps
+            )
+    return splitter._analysis_result(
+        hop_levels, duration, steps, measure, frame_length, hop_samples / sample_rate
+    )
+
+
+async def export_intervals(
+    file_in,
+    intervals,
+    clip_paths,
+    gains=None,
+    idle_timeout=IDLE_TIMEOUT_SECONDS,
+):
+    """Async export_intervals."""
+    for cmd in splitter._export_intervals_cmds(file_in, intervals, clip_paths, gains):
+        returncode, _, errors = await run_ffmpeg(cmd, idle_timeout, progress=True)
+        if returncode != 0:
+            raise OSError(f"Could not export clips: {errors}")
+
+
+async def export_takes(
+    file_in,
+    intervals,
+    clip_paths,
+    gains=None,
+    workers=2,
+    idle_timeout=IDLE_TIMEOUT_SECONDS,
+):
+    """Async export_takes, up to workers takes encoded at once. An error
+    cancels the other takes and kills their ffmpeg."""
+    slots = asyncio.Semaphore(workers)
+
+    async def export(index):
+        cmd = splitter._export_take_cmd(
+            file_in,
+            *intervals[index],
+            clip_paths[index],
+            None if gains is None else gains[index],
+        )
+        async with slots:
+            returncode, _, errors = await run_ffmpeg(cmd, idle_timeout, progress=True)
+        if returncode != 0:
+            raise OSError(f"Could not export {clip_paths[index]}: {errors}")
+
+    async with asyncio.TaskGroup() as group:
+        for index in range(len(intervals)):
+            group.create_task(export(index))
+
+
+async def export_stream_copy(
+    file_in, intervals, clip_paths, idle_timeout=IDLE_TIMEOUT_SECONDS
+):
+    """Async export_stream_copy, returns the largest cut point shift."""
+    if len(intervals) == 0:
+        return 0
+    returncode, output, errors = await run_ffmpeg(
+        splitter._packet_times_cmd(file_in), idle_timeout
+    )
+    if returncode != 0:
+        raise OSError(f"Could not read packets of {file_in}: {errors}")
+    boundaries = splitter._packet_boundaries(*splitter._parse_packet_times(output))
+    snapped, snap_error = splitter.snap_to_packets(intervals, boundaries)
+    returncode, _, errors = await run_ffmpeg(
+        splitter._stream_copy_cmd(file_in, snapped, clip_paths),
+        idle_timeout,
+        progress=True,
+    )
+    if returncode != 0:
+        raise OSError(f"Could not export clips: {errors}")
+    return snap_error
+
+
+async def process(
+    file_in,
+    output_path=None,
+    NORMALIZATION=False,
+    BEG_END_only=False,
+    silence_min_len=5,
+    volume_threshold=0.01,
+    window_size=1,
+    ease_in=0.6,
+    logger=None,
+    streaming=True,
+    analysis_rate=None,
+    stream_copy=False,
+    use_cache=False,
+    hop_size=None,
+    detector="peak",
+    noise_percentile=10,
+    noise_margin_db=10,
+    hysteresis_db=6,
+    shards=1,
+    export_workers=1,
+    follow=False,
+    follow_timeout=splitter.FOLLOW_TIMEOUT_SECONDS,
+    timeout=None,
+    idle_timeout=IDLE_TIMEOUT_SECONDS,
+    on_stage=None,
+    metrics_path=None,
+):
+    """Async split_file, with the same arguments and result.
+
+    Analysis always streams in this process: streaming and logger are
+    ignored, shards above 1 and follow raise ValueError. The whole job
+    raises TimeoutError after timeout seconds (None for no limit), each
+    ffmpeg process after idle_timeout seconds without output.
+    """
+    if shards > 1 or follow:
+        raise ValueError("pipeline.process supports neither shards nor follow")
+    splitter._check_detector(detector)
+    metrics = instrumentation.Instrumentation(file_in, on_stage, metrics_path)
+    with metrics.run() as totals:
+        async with asyncio.timeout(timeout):
+            with metrics.stage("probe"):
+                source = await open_source(file_in, idle_timeout)
+            if source.codec is None:
+                raise ValueError(f"{file_in} has no audio stream")
+            with metrics.stage("analysis") as stage:
+                levels, duration, *measured = await analyse_levels(
+                    source,
+                    window_size=window_size,
+                    analysis_rate=analysis_rate,
+                    use_cache=use_cache,
+                    hop_size=hop_size,
+                    measure=splitter.DETECTOR_MEASURES[detector],
+                    idle_timeout=idle_timeout,
+                    loudness=NORMALIZATION,
+                )
+                stage["audio_seconds"] = duration
+            intervals = splitter._intervals_stage(
+                metrics,
+                levels,
+                duration,
+                BEG_END_only=BEG_END_only,
+                silence_min_len=silence_min_len * 60,
+                volume_threshold=volume_threshold,
+                window_size=window_size,
+                ease_in=ease_in,
+                hop_size=hop_size,
+                detector=detector,
+                noise_percentile=noise_percentile,
+                noise_margin_db=noise_margin_db,
+                hysteresis_db=hysteresis_db,
+            )
+
+            processing_folder, clip_paths, container, normalization = (
+                splitter._plan_export(
+                    source,
+                    output_path,
+                    intervals,
+                    BEG_END_only,
+                    measured[0] if NORMALIZATION else None,
+                    stream_copy,
+                )
+            )
+            gains = normalization["gains"] if normalization else None
+            snap_error = None
+            with metrics.stage("export") as stage:
+                if container:
+                    snap_error = await export_stream_copy(
+                        source, intervals, clip_paths, idle_timeout
+                    )
+                    stage["snap_error"] = snap_error
+                elif export_workers > 1 and len(intervals) > 1:
+                    await export_takes(
+                        source,
+                        intervals,
+                        clip_paths,
+                        gains,
+                        export_workers,
+                        idle_timeout,
+                    )
+                else:
+                    await export_intervals(
+                        source, intervals, clip_paths, gains, idle_timeout
+                    )
+                stage.update(splitter._export_fields(intervals, clip_paths))
+        return splitter._split_result(
+            metrics,
+            totals,
+            intervals,
+            processing_folder,
+            clip_paths,
+            snap_error,
+            normalization,
+        )